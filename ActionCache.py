@@ -0,0 +1,188 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from threading import Lock, Timer, current_thread
+from time import time
+
+from KeywordMatcher import remove_filler_words
+
+class CachedActionSelector:
+    """LRU cache with a TTL in front of any action selector.
+
+    Commands are normalized first (lowercase, no punctuation, no filler words such as
+    "làm ơn"/"hãy"/"đi", compared without diacritics), so "Làm ơn bật đèn đi!" and
+    "bật đèn" share one entry. The cache is cleared whenever the actions change and can
+    be persisted to a JSON file so a restart keeps it warm, written at most every
+    `save_interval` seconds and on `close()`. Errors and keyword-fallback answers are never
+    cached.
+    """
+    def __init__(self, selector, max_size=256, ttl=3600.0, path: str | None = None, save_interval=5.0):
+        self.selector = selector
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = Lock()
+        self.save_lock = Lock()   # Held through the write and the rename of the cache file
+        self.save_timer = None
+        self.entries = OrderedDict()   # normalized command -> (action name, timestamp)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @property
+    def actions(self):
+        return self.selector.actions
+
+    def _fingerprint(self) -> list:
+        return sorted([action.name, action.description, action.vietnamese_description, action.keyword] for action in self.actions)
+
+    def _resolve(self, name):
+        """Maps a cached action name, or list of names, back to what the wrapped selector returns."""
+        if isinstance(name, list):
+            resolved = [self._resolve(item) for item in name]
+            return None if any(item in (None, "unknown") for item in resolved) else resolved
+        if name in ("unknown", None):
+            return "unknown"
+        for action in self.actions:
+            if action.name == name:
+                # Selectors in VoiceAssistant.py return Action objects, the ones in ActionSelector.py names
+                return action if self._returns_actions else name
+        return None
+
+    def update_actions(self, new_actions):
+        self.selector.update_actions(new_actions)
+        with self.lock:
+            self.entries.clear()
+        self._schedule_save()
+
+    def _cached(self, key: str, compute):
+        now = time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                result = self._resolve(entry[0])
+                if result is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+
+        fallback_flag = getattr(getattr(self.selector, "fallback", None), "flag", None)
+        if fallback_flag is not None:
+            fallback_flag.used = False
+        result = compute()
+        if isinstance(result, str) and result.startswith("Error"):
+            return result
+        if fallback_flag is not None and fallback_flag.used:
+            # A keyword-fallback answer while the LLM is down, ask the LLM again next time
+            return result
+        if isinstance(result, list):
+            if result:
+                self._returns_actions = not isinstance(result[0], str)
+            name = [item if isinstance(item, str) else item.name for item in result]
+        else:
+            self._returns_actions = not isinstance(result, str)
+            name = result if isinstance(result, str) else result.name
+        with self.lock:
+            self.entries[key] = (name, now)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        self._schedule_save()
+        return result
+
+    def generate_action(self, user_command: str):
+        return self._cached(remove_filler_words(user_command), lambda: self.selector.generate_action(user_command))
+
+    def generate_actions(self, user_command: str):
+        """Cached list of every action in the command, for selectors without it a list of at most one."""
+        def compute():
+            if hasattr(self.selector, "generate_actions"):
+                return self.selector.generate_actions(user_command)
+            result = self.selector.generate_action(user_command)
+            if isinstance(result, str) and (result == "unknown" or result.startswith("Error")):
+                return [] if result == "unknown" else result
+            return [result]
+        # Lists live next to single answers, under keys a normalized command cannot produce
+        return self._cached("*" + remove_filler_words(user_command), compute)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
+
+    def _schedule_save(self):
+        """Saves the cache `save_interval` seconds after the first change, batching later ones."""
+        if self.path is None:
+            return
+        with self.lock:
+            if self.save_timer is not None:
+                return
+            self.save_timer = Timer(self.save_interval, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.save_lock:
+            with self.lock:
+                if self.save_timer is current_thread():
+                    self.save_timer = None
+                data = {
+                    "actions": self._fingerprint(),
+                    "returns_actions": self._returns_actions,
+                    "entries": [[key, name, timestamp] for key, (name, timestamp) in self.entries.items()],
+                }
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as file:
+                try:
+                    json.dump(data, file, ensure_ascii=False)
+                except BaseException:
+                    file.close()
+                    os.remove(file.name)
+                    raise
+            os.replace(file.name, self.path)
+
+    def close(self):
+        """Writes pending changes, waiting for a save in progress, and closes the wrapped selector."""
+        with self.lock:
+            timer, self.save_timer = self.save_timer, None
+        if timer is not None:
+            timer.cancel()
+            timer.join()   # A save that already started must finish before the process exits
+        self.save()
+        if hasattr(self.selector, "close"):
+            self.selector.close()
+
+    def _load(self):
+        self._returns_actions = False
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            print("Could not read the action cache, starting with an empty one.")
+            return
+        # Entries computed for another set of actions are not valid anymore
+        if data.get("actions") != self._fingerprint():
+            return
+        self._returns_actions = data.get("returns_actions", False)
+        now = time()
+        for key, name, timestamp in data.get("entries", [])[-self.max_size:]:
+            if now - timestamp <= self.ttl:
+                self.entries[key] = (name, timestamp)
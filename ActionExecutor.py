@@ -0,0 +1,187 @@
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from threading import Condition, Thread
+from time import perf_counter
+
+from Metrics import NULL_METRICS
+
+class ActionExecutor:
+    """Runs action callbacks off the utterance pipeline, ordered per device.
+
+    Every action belongs to a device lane (`action.device`, or one shared lane when it
+    has none). Commands of the same device run one at a time in submission order, while
+    different devices run in parallel on `num_workers` workers. A call that takes longer
+    than `timeout` seconds is abandoned so its worker serves other devices, but its own
+    lane stays blocked until the call returns, so the device never sees commands out of
+    order. At most `max_abandoned` calls are abandoned at a time, past that a worker waits
+    for the hung call, so hung devices cannot take every thread from the others.
+    Submitting the same action again within `debounce_seconds` of the device's previous
+    command, e.g. a repeated "bật đèn", is coalesced into it instead of being run twice.
+    Each call runs on its own daemon thread, so a call that never returns cannot keep the
+    interpreter from exiting; commands still queued behind it on stop are counted as dropped.
+    """
+    def __init__(self, num_workers=2, timeout=5.0, debounce_seconds=1.5, max_abandoned=None, metrics=None):
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.debounce_seconds = debounce_seconds
+        self.max_abandoned = num_workers if max_abandoned is None else max_abandoned
+        self.metrics = metrics or NULL_METRICS
+
+        self.cond = Condition()
+        self.lanes: dict[str, deque] = {}   # device -> queued (action, submit time)
+        self.busy = set()                   # Devices with a running or abandoned action
+        self.abandoned = 0                  # Timed out calls that have not returned yet
+        self.ready = deque()                # Devices with queued actions, in the order they became ready
+        self.last_submitted = {}            # device -> (action name, submit time)
+        self.is_running = False
+        self.workers = []
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.dropped = 0
+
+    @staticmethod
+    def device_of(action) -> str:
+        return getattr(action, "device", None) or "default"
+
+    def start(self):
+        self.is_running = True
+        self.workers = [Thread(target=self._worker, name="action-executor", daemon=True) for _ in range(self.num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, wait=True):
+        """Stops the workers, running the queued actions first if `wait` is True."""
+        with self.cond:
+            if not wait:
+                self._drop_queued()
+            self.is_running = False
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+        with self.cond:
+            # Left behind abandoned calls that had not returned when the workers stopped
+            self._drop_queued()
+
+    def _drop_queued(self):
+        dropped = sum(len(lane) for lane in self.lanes.values())
+        self.lanes.clear()
+        self.ready.clear()
+        if dropped:
+            self.dropped += dropped
+            self.metrics.inc("actions_dropped", dropped)
+            print(f"Dropped {dropped} queued actions on stop.")
+
+    def submit(self, action) -> bool:
+        """Queues an action and returns at once, False if it was coalesced into a recent identical one."""
+        now = perf_counter()
+        device = self.device_of(action)
+        with self.cond:
+            # Only a repeat of the device's latest command is redundant, "on, off, on" must all run
+            last_name, last_time = self.last_submitted.get(device, (None, None))
+            if last_name == action.name and now - last_time < self.debounce_seconds:
+                self.coalesced += 1
+                self.metrics.inc("actions_coalesced")
+                return False
+            self.last_submitted[device] = (action.name, now)
+            lane = self.lanes.setdefault(device, deque())
+            if not lane and device not in self.busy:
+                self.ready.append(device)
+            lane.append((action, now))
+            self.submitted += 1
+            self.cond.notify()
+            return True
+
+    def _next(self):
+        with self.cond:
+            # On stop, commands queued behind an abandoned call that never returns are dropped
+            self.cond.wait_for(lambda: self.ready or (not self.is_running and len(self.busy) == self.abandoned))
+            if not self.ready:
+                return None
+            device = self.ready.popleft()
+            self.busy.add(device)
+            action, submitted = self.lanes[device].popleft()
+            return device, action, submitted
+
+    def _finish(self, device, outcome: str):
+        with self.cond:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if outcome != "timed_out":
+                self._release(device)
+
+    def _release(self, device, abandoned=False):
+        """Lets the next queued command of the device run."""
+        with self.cond:
+            if abandoned:
+                self.abandoned -= 1
+            self.busy.discard(device)
+            if self.lanes.get(device):
+                self.ready.append(device)
+            else:
+                self.lanes.pop(device, None)
+            self.cond.notify_all()
+
+    @staticmethod
+    def _call(func) -> Future:
+        """Runs `func` on a new daemon thread, so an abandoned call never blocks interpreter exit."""
+        future = Future()
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func())
+                except BaseException as error:
+                    future.set_exception(error)
+        Thread(target=run, name="action-call", daemon=True).start()
+        return future
+
+    def _wait(self, future) -> tuple[str, str]:
+        """Waits for a call and returns its (outcome, status), abandoning it after `timeout` if allowed."""
+        try:
+            error = future.exception(timeout=self.timeout)
+        except TimeoutError:
+            with self.cond:
+                abandon = self.abandoned < self.max_abandoned
+                self.abandoned += abandon
+            if abandon:
+                self.metrics.inc("action_timeouts")
+                return "timed_out", f"timed out after {self.timeout:.1f} s, its device waits until it returns"
+            # Enough hung calls already hold threads, wait for this one instead of adding another
+            error = future.exception()
+        if error is not None:
+            self.metrics.inc("action_failures")
+            return "failed", f"failed: {error}"
+        return "completed", "done"
+
+    def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            device, action, submitted = job
+            started = perf_counter()
+            self.metrics.observe("action_dispatch", started - submitted)
+            future = self._call(action.func)
+            outcome, status = self._wait(future)
+            finished = perf_counter()
+            self.metrics.observe("action_completion", finished - submitted)
+            print(f"Action {action.name} {status} (dispatch {(started - submitted) * 1000:.1f} ms, "
+                  f"total {(finished - submitted) * 1000:.1f} ms)")
+            self._finish(device, outcome)
+            if outcome == "timed_out":
+                future.add_done_callback(lambda _, device=device: self._release(device, abandoned=True))
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "abandoned": self.abandoned,
+                "dropped": self.dropped,
+                "pending": sum(len(lane) for lane in self.lanes.values()),
+            }
@@ -1,6 +1,14 @@
 import requests
+from LLMClient import OllamaClient, SelectorFallback, enum_format, enum_list_format, collapse_repeats, get_client, parse_enum_list_response, parse_enum_response, parse_free_list_response
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
+import re
+from threading import Lock, RLock
 import random
+import zlib
+import numpy as np
+from KeywordMatcher import KeywordMatcher, expand_synonyms, remove_filler_words, strip_diacritics
 
 @dataclass
 class Action:
@@ -13,11 +21,26 @@ class Action:
         return f"Action: {self.name}, Description: {self.description}, Vietnamese Description: {self.vietnamese_description}, Keyword: {self.keyword}"
 
 class LLMActionSelector:
-    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False):
+    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False, client: OllamaClient | None = None, use_fallback=True,
+                 reuse_context=False, keep_alive="30m", constrained=False):
         self.debug = debug
         self.model = model
         self.api_url = api_url
         self.actions = actions
+        self.client = client or get_client()
+        self.fallback = SelectorFallback(WordsMatchingActionSelector(actions), enabled=use_fallback)
+        # Decode exactly one of the action names as JSON, with num_predict capped to fit it
+        self.constrained = constrained
+        # Prime the few-shot prefix once and only send the command afterwards
+        self.reuse_context = reuse_context
+        self.keep_alive = keep_alive
+        self.context = None
+        self.context_lock = Lock()
+        self.prime_lock = RLock()   # Held while priming, so concurrent first commands prime only once
+        self.stats_lock = Lock()
+        self.prompt_eval_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.prompt_eval_calls = 0
         
         self.base_prompt_template = (
 """You are an AI model tasked with classifying user's command into one of the following actions:  
@@ -37,10 +60,17 @@ User's command -> Desired output:
 """
         )
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
+        self.list_format, self.list_num_predict = enum_list_format([action.name for action in self.actions])
         
     def update_actions(self, new_actions):
         self.actions = new_actions
+        self.fallback.update_actions(new_actions)
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
+        self.list_format, self.list_num_predict = enum_list_format([action.name for action in self.actions])
+        with self.context_lock:
+            self.context = None   # Re-primed with the new prompt on the next command
     
     def _generate_prompt(self):
         action_list = "\n".join(f'- "{action.name}": {action.description}' for action in self.actions)
@@ -53,57 +83,205 @@ User's command -> Desired output:
         examples += '\n"hôm nay thời tiết thế nào?" -> "unknown"' 
         return self.base_prompt_template.format(action_list=action_list, examples=examples)
     
-    def generate_action(self, user_command: str):
-        prompt = self.prompt + f'User\'s command: "{user_command.lower()}"\nDesired output: '
+    def _record_prompt_eval(self, result: dict):
+        tokens = result.get("prompt_eval_count", 0)
+        seconds = result.get("prompt_eval_duration", 0) / 1e9
+        with self.stats_lock:
+            self.prompt_eval_tokens += tokens
+            self.prompt_eval_seconds += seconds
+            self.prompt_eval_calls += 1
         if self.debug:
-            print("[DEBUG] prompt: " + prompt)
+            print(f"[DEBUG] prompt eval: {tokens} tokens in {seconds * 1000:.1f} ms")
+
+    def prompt_eval_stats(self) -> dict:
+        """Average prompt tokens the LLM evaluated, and the time it took, per command."""
+        with self.stats_lock:
+            calls = max(self.prompt_eval_calls, 1)
+            return {"calls": self.prompt_eval_calls,
+                    "tokens_per_call": self.prompt_eval_tokens / calls,
+                    "ms_per_call": self.prompt_eval_seconds / calls * 1000}
+
+    def prime(self):
+        """Evaluates the fixed few-shot prefix once and keeps the returned context.
+
+        The request is not raw, so the prefix goes through the model's chat template and every
+        command is sent as the next user turn. Unlike without reuse_context, the prefix and the
+        command are two turns instead of one message; the "(context)" rows of the benchmark
+        measure what that costs in accuracy.
+        """
+        with self.prime_lock:
+            data = {
+                "model": self.model,
+                "prompt": self.prompt,
+                "stream": False,
+                "keep_alive": self.keep_alive,
+                "options": {"temperature": 0.0, "num_predict": 1}
+            }
+            result = self.client.post(self.api_url, data)
+            context = result.get("context")
+            if context:
+                # Drop the token generated while priming, only the prefix is reused
+                context = context[:len(context) - result.get("eval_count", 0)]
+            with self.context_lock:
+                self.context = context or []
+        if self.debug:
+            print(f"[DEBUG] primed {result.get('prompt_eval_count', 0)} prompt tokens")
+
+    def _primed_context(self) -> list:
+        """The context of the primed prefix, priming it first if needed."""
+        with self.context_lock:
+            context = self.context
+        if context is None:
+            with self.prime_lock:
+                # Another command may have primed it while this one waited for the lock
+                with self.context_lock:
+                    context = self.context
+                if context is None:
+                    self.prime()
+                    with self.context_lock:
+                        context = self.context
+        return context
+
+    def _complete(self, suffix: str, answer_format: dict, num_predict: int) -> str:
+        """Sends the few-shot prompt followed by `suffix` and returns the raw answer."""
         data = {
             "model": self.model,
-            "prompt": prompt,
+            "prompt": self.prompt + suffix,
             "stream": False,
             "options": {"temperature": 0.0}
         }
+        if self.reuse_context:
+            context = self._primed_context()
+            data["keep_alive"] = self.keep_alive
+            if context:
+                # The few-shot prompt was the priming turn, otherwise the server returned no context
+                data["prompt"] = suffix
+                data["context"] = context
+        if self.constrained:
+            data["format"] = answer_format
+            data["options"]["num_predict"] = num_predict
+        if self.debug:
+            print("[DEBUG] prompt: " + data["prompt"])
+        result = self.client.post(self.api_url, data)
+        self._record_prompt_eval(result)
+        text = result.get('response')
+        if self.debug:
+            print("[DEBUG] response: " + text)
+        return text
+
+    def generate_action(self, user_command: str):
+        suffix = f'User\'s command: "{user_command.lower()}"\nDesired output: '
         try:
-            response = requests.post(self.api_url, json=data)
-            response.raise_for_status()
-            text = response.json().get('response')
-            if self.debug:
-                print("[DEBUG] response: " + text)
-            for action in self.actions:
-                if action.name in text:
-                    return action.name
-            return "unknown"
+            text = self._complete(suffix, self.answer_format, self.num_predict)
         except requests.exceptions.RequestException as error:
-            return f"Error: {error}"
-        
+            return self.fallback.answer(user_command, error)
+        name = parse_enum_response(text, self.answer_format["enum"]) if self.constrained else None
+        for action in self.actions:
+            if action.name == name or (name is None and action.name in text):
+                return action.name
+        return "unknown"
+
+    def generate_actions(self, user_command: str) -> list:
+        """Every action the command calls, in the order it asks for them, from one LLM request."""
+        suffix = (f'User\'s command: "{user_command.lower()}"\n'
+                  'The command may call several actions, return all of them as a JSON list in the order they are asked, '
+                  'or an empty list if none match.\nDesired output: ')
+        try:
+            text = self._complete(suffix, self.list_format, self.list_num_predict)
+        except requests.exceptions.RequestException as error:
+            return self.fallback.answer(user_command, error, multiple=True)
+        names = parse_enum_list_response(text, self.list_format["items"]["enum"]) if self.constrained else None
+        if names is None:
+            # Free-form answer, take the action names in the order they appear
+            names = parse_free_list_response(text, [action.name for action in self.actions])
+        return names
+
 class LLMActionSelector2:
-    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False):
+    """Asks the LLM one yes/no question per action.
+
+    The questions are sent concurrently, at most `max_concurrency` at a time. With
+    `early_stop_confidence` set, the first "yes" whose probability reaches it is returned
+    and the questions not sent yet are cancelled. With `batched=True` all actions are
+    listed in a single prompt, and the answered number is scored from the logprobs of all
+    of its tokens, since many tokenizers split "10" into "1" and "0".
+    """
+    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False, client: OllamaClient | None = None, use_fallback=True,
+                 max_concurrency=4, batched=False, early_stop_confidence=None, batch_threshold=0.5, top_logprobs=20):
         self.debug = debug
         self.model = model
         self.api_url = api_url
         self.actions = actions
+        self.client = client or get_client()
+        self.fallback = SelectorFallback(WordsMatchingActionSelector(actions), enabled=use_fallback)
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-yes-no")
+        self.batched = batched
+        self.early_stop_confidence = early_stop_confidence   # None waits for every answer
+        self.batch_threshold = batch_threshold               # Minimum probability of the answered action in batched mode
+        self.top_logprobs = top_logprobs
         
         self.base_prompt_template = "Is the user's command \"{command}\" call the action \"{action}: {description}\"? Answer only with \"yes\" or \"no\", no further explanation."
+        self.batch_prompt_template = (
+"""Which action does the user's command "{command}" call?
+{action_list}
+0. None of the actions above.
+Answer only with the number of the action, no further explanation."""
+        )
     
+    def update_actions(self, new_actions):
+        self.actions = new_actions
+        self.fallback.update_actions(new_actions)
+
+    @staticmethod
+    def _first_token_probabilities(result: dict) -> dict[str, float] | None:
+        """Probability of each candidate first answer token, None when Ollama returned no logprobs."""
+        logprobs = result.get("logprobs")
+        if not logprobs:
+            return None
+        first = logprobs[0]
+        probabilities = {}
+        for candidate in first.get("top_logprobs") or [first]:
+            token = candidate["token"].strip().lower()
+            probabilities[token] = probabilities.get(token, 0.0) + math.exp(candidate["logprob"])
+        return probabilities
+
+    def _ask(self, prompt: str, logprobs: bool) -> dict:
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": 0.0}
+        }
+        if logprobs:
+            data["logprobs"] = True
+            data["top_logprobs"] = self.top_logprobs
+        return self.client.post(self.api_url, data)
+
     def generate_action(self, user_command: str):
+        if self.batched:
+            return self._generate_action_batched(user_command)
         prompts = [self.base_prompt_template.format(command=user_command.lower(), action=action.name, description=action.description) for action in self.actions]
         if self.debug:
             print("[DEBUG] prompts: ", prompts)
-        res = []
-        for prompt in prompts:
-            data = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {"temperature": 0.0}
-            }
-            try:
-                response = requests.post(self.api_url, json=data)
-                response.raise_for_status()
-                text = response.json().get('response')
-                res.append(text.lower())
-            except requests.exceptions.RequestException as error:
-                return f"Error: {error}"
+        early_stop = self.early_stop_confidence is not None
+        futures = {self.executor.submit(self._ask, prompt, early_stop): i for i, prompt in enumerate(prompts)}
+        res = [""] * len(prompts)
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                result = future.result()
+                res[i] = result.get('response').lower()
+                if early_stop and "yes" in res[i]:
+                    probabilities = self._first_token_probabilities(result)
+                    if probabilities is not None and probabilities.get("yes", 0.0) >= self.early_stop_confidence:
+                        if self.debug:
+                            print(f"[DEBUG] confident yes for {self.actions[i].name}: {probabilities['yes']:.3f}")
+                        return self.actions[i].name
+        except requests.exceptions.RequestException as error:
+            return self.fallback.answer(user_command, error)
+        finally:
+            for future in futures:
+                future.cancel()
         if self.debug:
             print("[DEBUG] responses: ", res)
         yes_count = 0
@@ -117,12 +295,58 @@ class LLMActionSelector2:
                 return self.actions[i].name
         return "unknown"
 
+    def _generate_action_batched(self, user_command: str):
+        action_list = "\n".join(f"{i}. {action.name}: {action.description}" for i, action in enumerate(self.actions, 1))
+        prompt = self.batch_prompt_template.format(command=user_command.lower(), action_list=action_list)
+        if self.debug:
+            print("[DEBUG] prompt: ", prompt)
+        try:
+            result = self._ask(prompt, logprobs=True)
+        except requests.exceptions.RequestException as error:
+            return self.fallback.answer(user_command, error)
+        answer = re.match(r"\s*(\d+)", result.get('response', ''))
+        if answer is None or not 1 <= int(answer.group(1)) <= len(self.actions):
+            return "unknown"
+        label = answer.group(1)
+        probability = self._label_probability(result, label)
+        if self.debug:
+            print(f"[DEBUG] answer: {label}, probability: {probability}")
+        # Ollama without logprobs support gives no probability, trust the greedy answer
+        if probability is not None and probability < self.batch_threshold:
+            return "unknown"
+        return self.actions[int(label) - 1].name
+
+    @staticmethod
+    def _label_probability(result: dict, label: str) -> float | None:
+        """Probability of the whole answered label, the product over the tokens that spell it."""
+        logprobs = result.get("logprobs")
+        if not logprobs:
+            return None
+        text = ""
+        total = 0.0
+        for entry in logprobs:
+            text += entry["token"]
+            total += entry["logprob"]
+            if text.strip() == label:
+                return math.exp(total)
+            if not label.startswith(text.strip()):
+                break
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 class LLMActionSelector3:
-    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False):
+    def __init__(self, actions: list[Action], model="llama3.1", api_url="http://localhost:11434/api/generate", debug=False, client: OllamaClient | None = None, use_fallback=True,
+                 constrained=False):
         self.debug = debug
         self.model = model
         self.api_url = api_url
         self.actions = actions
+        self.client = client or get_client()
+        self.fallback = SelectorFallback(WordsMatchingActionSelector(actions), enabled=use_fallback)
+        # Decode exactly one of the action names as JSON, with num_predict capped to fit it
+        self.constrained = constrained
         
         self.base_prompt_template = (
 """You are an AI model tasked with classifying user's command into one of the following actions:  
@@ -142,10 +366,13 @@ User's command -> Desired output:
 """
         )
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
         
     def update_actions(self, new_actions):
         self.actions = new_actions
+        self.fallback.update_actions(new_actions)
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
     
     def _generate_prompt(self):
         action_list = "\n".join(f'- "{action.name}": {action.description}' for action in self.actions)
@@ -169,29 +396,123 @@ User's command -> Desired output:
             "stream": False,
             "options": {"temperature": 0.0}
         }
+        if self.constrained:
+            data["format"] = self.answer_format
+            data["options"]["num_predict"] = self.num_predict
         try:
-            response = requests.post(self.api_url, json=data)
-            response.raise_for_status()
-            text = response.json().get('response')
+            text = self.client.post(self.api_url, data).get('response')
             if self.debug:
                 print("[DEBUG] response: " + text)
+            name = parse_enum_response(text, self.answer_format["enum"]) if self.constrained else None
             for action in self.actions:
-                if action.name in text:
+                if action.name == name or (name is None and action.name in text):
                     return action.name
             return "unknown"
         except requests.exceptions.RequestException as error:
-            return f"Error: {error}"
+            return self.fallback.answer(user_command, error)
         
 class WordsMatchingActionSelector:
     def __init__(self, actions: list[Action]):
-        self.actions = actions
+        self.matcher = KeywordMatcher()
+        self.update_actions(actions)
+
+    def update_actions(self, new_actions: list[Action]):
+        self.actions = new_actions
+        # Compile every keyword and its synonym variants into one automaton
+        self.matcher.build([(action.keyword, action) for action in self.actions])
     
     def generate_action(self, user_command: str):
-        user_command = user_command.lower()
-        for action in self.actions:
-            if action.keyword in user_command:
-                return action.name
-        return "unknown"
+        match = self.matcher.best(user_command)
+        if match is None:
+            return "unknown"
+        return match.value.name
+
+    def generate_actions(self, user_command: str):
+        """Every action whose keyword appears in the command, in spoken order with repeats kept, from one matcher pass."""
+        return collapse_repeats([match.value.name for match in self.matcher.non_overlapping(user_command)])
+
+class HashingEmbedder:
+    """Embeds text as an L2-normalized hashed bag of syllables, syllable bigrams and diacritic-free syllables.
+
+    It needs no model and embeds every text independently, so embeddings can be cached per action.
+    Any callable mapping a string to a 1-D float32 vector can be used instead.
+    """
+    def __init__(self, dim=2048):
+        self.dim = dim
+
+    def _index(self, feature: str) -> int:
+        return zlib.crc32(feature.encode("utf-8")) % self.dim
+
+    def __call__(self, text: str) -> np.ndarray:
+        syllables = text.lower().split()
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for syllable in syllables:
+            vector[self._index(syllable)] += 1.0
+            vector[self._index("~" + strip_diacritics(syllable))] += 0.5
+        for first, second in zip(syllables, syllables[1:]):
+            vector[self._index(first + "_" + second)] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+class EmbeddingActionSelector:
+    """Classifies a command by cosine similarity against precomputed embeddings of every action.
+
+    Each action is embedded once from its description, Vietnamese description, keyword and
+    paraphrase variants. The variants of all actions are stacked in one matrix, so a command
+    is classified with a single matrix-vector product.
+    """
+    def __init__(self, actions: list[Action], embed=None, threshold=0.5, paraphrases: dict[str, list[str]] | None = None):
+        self.embed = embed or HashingEmbedder()
+        self.threshold = threshold
+        self.paraphrases = paraphrases or {}
+        self._cache = {}  # action fields -> (variants, dim) matrix
+        self.update_actions(actions)
+
+    @staticmethod
+    def _key(action: Action):
+        return (action.name, action.description, action.vietnamese_description, action.keyword)
+
+    def _variants(self, action: Action) -> list[str]:
+        texts = set()
+        for text in [action.keyword, action.vietnamese_description, action.description, *self.paraphrases.get(action.name, [])]:
+            texts.update(expand_synonyms(text))
+        return sorted(remove_filler_words(text) for text in texts)
+
+    def update_actions(self, new_actions: list[Action]):
+        """Rebuilds the index, only embedding actions that were added or changed."""
+        self.actions = new_actions
+        cache = {}
+        for action in new_actions:
+            key = self._key(action)
+            if key not in cache:
+                cache[key] = self._cache.get(key)
+                if cache[key] is None:
+                    cache[key] = np.stack([self.embed(text) for text in self._variants(action)])
+        self._cache = cache
+        blocks = [cache[self._key(action)] for action in new_actions]
+        self.matrix = np.concatenate(blocks) if blocks else np.zeros((0, 1), dtype=np.float32)
+        self.row_action = np.repeat(np.arange(len(blocks)), [len(block) for block in blocks])
+        # Features that appear in no action (e.g. unknown words) are ignored in the command
+        self.feature_mask = (self.matrix != 0).any(axis=0)
+
+    def scores(self, user_command: str) -> np.ndarray:
+        """Best cosine similarity of the command to each action."""
+        query = self.embed(remove_filler_words(user_command)) * self.feature_mask
+        norm = np.linalg.norm(query)
+        best = np.full(len(self.actions), -1.0, dtype=np.float32)
+        if norm == 0 or len(self.matrix) == 0:
+            return best
+        np.maximum.at(best, self.row_action, self.matrix @ (query / norm))
+        return best
+
+    def generate_action(self, user_command: str):
+        scores = self.scores(user_command)
+        if len(scores) == 0:
+            return "unknown"
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return "unknown"
+        return self.actions[best].name
 
 if __name__ == "__main__":
     from time import time
@@ -280,6 +601,34 @@ if __name__ == "__main__":
         ("nhạc dừng lại", "stop_music"),
     ]
 
+    # Phrasings written apart from the tests above and never used to tune SYNONYMS or FILLER_WORDS
+    held_out_tests = [
+        ("bật giùm cái đèn", "turn_on_light"),
+        ("mở đèn giúp mình", "turn_on_light"),
+        ("tắt bóng đèn", "turn_off_light"),
+        ("mở cái quạt", "turn_on_fan"),
+        ("ngắt quạt", "turn_off_fan"),
+        ("mở tivi lên", "turn_on_tv"),
+        ("tắt tv", "turn_off_tv"),
+        ("mở máy lạnh", "turn_on_air_conditioner"),
+        ("vui lòng tắt điều hoà", "turn_off_air_conditioner"),
+        ("mở nhạc", "play_music"),
+        ("bật nhạc lên", "play_music"),
+        ("ngừng nhạc", "stop_music"),
+        ("tắt nhạc với", "stop_music"),
+        ("trời hôm nay đẹp quá", "unknown"),
+        ("mấy giờ rồi", "unknown"),
+    ]
+
+    multi_tests = [
+        ("tắt đèn và bật quạt", ["turn_off_light", "turn_on_fan"]),
+        ("bật ti vi rồi phát nhạc", ["turn_on_tv", "play_music"]),
+        ("tắt quạt, tắt đèn và bật điều hòa", ["turn_off_fan", "turn_off_light", "turn_on_air_conditioner"]),
+        ("dừng nhạc rồi tắt ti vi giúp tôi", ["stop_music", "turn_off_tv"]),
+        ("bật đèn", ["turn_on_light"]),
+        ("bạn khoẻ không?", []),
+    ]
+
     models = ["smollm2", "llama3.2", "phi4-mini", "qwen2.5", "llama3.1", "gemma3"]
 
     baseline_selector = WordsMatchingActionSelector(action_lst)
@@ -288,18 +637,52 @@ if __name__ == "__main__":
         if baseline_selector.generate_action(user_command) == expected
     )
     baseline_accuracy = baseline_correct / len(tests)
+    baseline_held_out = sum(
+        1 for user_command, expected in held_out_tests
+        if baseline_selector.generate_action(user_command) == expected
+    ) / len(held_out_tests)
+    baseline_multi_accuracy = sum(
+        1 for user_command, expected in multi_tests
+        if baseline_selector.generate_actions(user_command) == expected
+    ) / len(multi_tests)
+
+    embedding_selector = EmbeddingActionSelector(action_lst)
+    start_time = time()
+    embedding_correct = sum(
+        1 for user_command, expected in tests
+        if embedding_selector.generate_action(user_command) == expected
+    )
+    embedding_time = time() - start_time
+    embedding_accuracy = embedding_correct / len(tests)
+    embedding_held_out = sum(
+        1 for user_command, expected in held_out_tests
+        if embedding_selector.generate_action(user_command) == expected
+    ) / len(held_out_tests)
 
     model_results = []
+    multi_results = []
+    prompt_eval_results = []
     wrong_details = []
 
     for model in models:
         action_selectors = [
-            LLMActionSelector(action_lst, model=model), 
-            LLMActionSelector2(action_lst, model=model), 
-            LLMActionSelector3(action_lst, model=model)
+            LLMActionSelector(action_lst, model=model, use_fallback=False), 
+            LLMActionSelector(action_lst, model=model, use_fallback=False, reuse_context=True), 
+            LLMActionSelector(action_lst, model=model, use_fallback=False, constrained=True), 
+            LLMActionSelector2(action_lst, model=model, use_fallback=False), 
+            LLMActionSelector2(action_lst, model=model, use_fallback=False, batched=True), 
+            LLMActionSelector3(action_lst, model=model, use_fallback=False), 
+            LLMActionSelector3(action_lst, model=model, use_fallback=False, constrained=True)
         ]
         
         for action_selector in action_selectors:
+            selector_name = action_selector.__class__.__name__
+            if getattr(action_selector, "batched", False):
+                selector_name += " (batched)"
+            if getattr(action_selector, "reuse_context", False):
+                selector_name += " (context)"
+            if getattr(action_selector, "constrained", False):
+                selector_name += " (enum)"
             accuracy = 0
             wrong_result = []
             action_selector.generate_action("bạn khoẻ không?") # Warmup
@@ -311,33 +694,66 @@ if __name__ == "__main__":
                 else:
                     wrong_result.append((user_command, result))
             time1 = time() - start_time
+            if hasattr(action_selector, "prompt_eval_stats"):
+                prompt_eval_results.append({"model": model, "selector": selector_name, **action_selector.prompt_eval_stats()})
+            if hasattr(action_selector, "generate_actions"):
+                # Multi-intent commands, measured after the single ones so prompt eval stats stay comparable
+                start_time = time()
+                multi_correct = 0
+                for user_command, expected in multi_tests:
+                    result = action_selector.generate_actions(user_command)
+                    if result == expected:
+                        multi_correct += 1
+                    else:
+                        wrong_result.append((user_command, result))
+                multi_results.append({"model": model, "selector": selector_name, "accuracy": multi_correct / len(multi_tests), "time": time() - start_time})
+            if hasattr(action_selector, "close"):
+                action_selector.close()
 
             model_results.append({
                 "model": model,
-                "selector": action_selector.__class__.__name__,
+                "selector": selector_name,
                 "accuracy": accuracy / len(tests),
                 "time": time1
             })
         
             wrong_details.append({
                 "model": model,
-                "selector": action_selector.__class__.__name__,
+                "selector": selector_name,
                 "wrong_results": wrong_result
             })
 
     md_lines = []
     md_lines.append("# Benchmark Results\n\n")
     md_lines.append("## Baseline\n")
-    md_lines.append("| Selector                    | Accuracy   |\n")
-    md_lines.append("|-----------------------------|------------|\n")
-    md_lines.append(f"| WordsMatchingActionSelector | {baseline_accuracy:.2%} |\n\n")
+    md_lines.append("| Selector                    | Accuracy   | Held-out accuracy | Time Taken (s) |\n")
+    md_lines.append("|-----------------------------|------------|-------------------|----------------|\n")
+    md_lines.append(f"| WordsMatchingActionSelector | {baseline_accuracy:.2%} | {baseline_held_out:.2%} | - |\n")
+    md_lines.append(f"| EmbeddingActionSelector     | {embedding_accuracy:.2%} | {embedding_held_out:.2%} | {embedding_time:.4f} |\n\n")
 
     md_lines.append("## Model Results\n")
-    md_lines.append("| Model     | Selector              | Accuracy   | Time Taken (s) |\n")
-    md_lines.append("|-----------|-----------------------|------------|----------------|\n")
+    md_lines.append("| Model     | Selector                     | Accuracy   | Time Taken (s) |\n")
+    md_lines.append("|-----------|------------------------------|------------|----------------|\n")
     for result in model_results:
         md_lines.append(
-            f"| {result['model']:<9} | {result['selector']:<21} | {result['accuracy']:.2%} | {result['time']:.2f} |\n"
+            f"| {result['model']:<9} | {result['selector']:<28} | {result['accuracy']:.2%} | {result['time']:.2f} |\n"
+        )
+
+    md_lines.append("\n## Multi-Intent Commands\n")
+    md_lines.append("| Model     | Selector                     | Accuracy   | Time Taken (s) |\n")
+    md_lines.append("|-----------|------------------------------|------------|----------------|\n")
+    md_lines.append(f"| -         | {'WordsMatchingActionSelector':<28} | {baseline_multi_accuracy:.2%} | - |\n")
+    for result in multi_results:
+        md_lines.append(
+            f"| {result['model']:<9} | {result['selector']:<28} | {result['accuracy']:.2%} | {result['time']:.2f} |\n"
+        )
+
+    md_lines.append("\n## Prompt Evaluation per Command\n")
+    md_lines.append("| Model     | Selector                     | Prompt tokens | Prompt eval (ms) |\n")
+    md_lines.append("|-----------|------------------------------|---------------|------------------|\n")
+    for result in prompt_eval_results:
+        md_lines.append(
+            f"| {result['model']:<9} | {result['selector']:<28} | {result['tokens_per_call']:.1f} | {result['ms_per_call']:.1f} |\n"
         )
 
     md_lines.append("\n## Detailed Wrong Results\n")
@@ -350,5 +766,12 @@ if __name__ == "__main__":
                 md_lines.append(f"| {user_command} | {generated} |\n")
             md_lines.append("\n")
 
+    client_stats = get_client().stats()
+    md_lines.append("## Ollama Client\n")
+    md_lines.append("| Calls | Failures | Rejected | p50 (s) | p90 (s) | p99 (s) |\n")
+    md_lines.append("|-------|----------|----------|---------|---------|---------|\n")
+    percentiles = [f"{client_stats[key]:.3f}" if client_stats[key] is not None else "-" for key in ("p50", "p90", "p99")]
+    md_lines.append(f"| {client_stats['calls']} | {client_stats['failures']} | {client_stats['rejected']} | {' | '.join(percentiles)} |\n\n")
+
     with open("Benchmark.md", "a", encoding="utf-8") as file:
         file.writelines(md_lines)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import os
+import wave
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+import numpy as np
+
+class AudioSource:
+    """Delivers 16-bit mono chunks to a PyAudio-style stream callback.
+
+    Subclasses only implement `_generate()`, which yields the whole signal as int16
+    arrays. Chunks are delivered from a background thread at `speed` times real time,
+    `speed=0` delivers them without any pacing.
+    """
+    continue_flag = 0   # pyaudio.paContinue, offline sources ignore the callback's return value
+
+    def __init__(self, sample_rate=16000, chunk_size=512, speed=1.0):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.callback = None
+        self.thread = None
+        self.stopped = Event()
+        self.finished = Event()   # Set once the whole signal has been delivered
+        self.start_time = None    # perf_counter() when the first chunk was delivered
+
+    def open(self, callback):
+        self.callback = callback
+
+    def _generate(self):
+        raise NotImplementedError
+
+    def _run(self):
+        chunk_seconds = self.chunk_size / self.sample_rate
+        pending = np.zeros(0, dtype=np.int16)
+        delivered = 0
+        self.start_time = perf_counter()
+        for audio in self._generate():
+            pending = np.concatenate([pending, audio])
+            while len(pending) >= self.chunk_size and not self.stopped.is_set():
+                chunk, pending = pending[:self.chunk_size], pending[self.chunk_size:]
+                if self.speed:
+                    # Pace against the start time so sleep jitter does not accumulate
+                    delay = self.start_time + delivered * chunk_seconds / self.speed - perf_counter()
+                    if delay > 0:
+                        sleep(delay)
+                self.callback(chunk.tobytes(), self.chunk_size, None, 0)
+                delivered += 1
+            if self.stopped.is_set():
+                break
+        self.finished.set()
+
+    def start(self):
+        self.stopped.clear()
+        self.finished.clear()
+        self.thread = Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        pass
+
+    def wall_time(self, sample: int) -> float:
+        """perf_counter() at which the given sample of the signal was delivered."""
+        return self.start_time + sample / self.sample_rate / (self.speed or float("inf"))
+
+class MicrophoneSource(AudioSource):
+    """The live microphone through PyAudio."""
+    def open(self, callback):
+        import pyaudio
+        self.continue_flag = pyaudio.paContinue
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=self.sample_rate,
+            input=True,
+            frames_per_buffer=self.chunk_size,
+            stream_callback=callback
+        )
+
+    def start(self):
+        self.stream.start_stream()
+
+    def stop(self):
+        self.stream.stop_stream()
+
+    def close(self):
+        self.stream.close()
+        self.p.terminate()
+
+def read_wav(path: str, sample_rate=16000) -> np.ndarray:
+    """Reads a mono 16-bit WAV file at the expected sample rate as int16."""
+    with wave.open(path, "rb") as wav:
+        if wav.getframerate() != sample_rate or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be {sample_rate} Hz mono 16-bit PCM")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+class ArraySource(AudioSource):
+    """Replays an int16 signal, followed by silence so the last utterance is closed."""
+    def __init__(self, audio: np.ndarray, sample_rate=16000, chunk_size=512, speed=1.0, trailing_silence=2.0):
+        super().__init__(sample_rate, chunk_size, speed)
+        self.audio = audio
+        self.trailing_silence = trailing_silence
+
+    def _generate(self):
+        yield self.audio
+        yield np.zeros(int(self.trailing_silence * self.sample_rate) + self.chunk_size, dtype=np.int16)
+
+class WavFileSource(ArraySource):
+    """Replays one WAV file."""
+    def __init__(self, path: str, sample_rate=16000, chunk_size=512, speed=1.0, trailing_silence=2.0):
+        super().__init__(read_wav(path, sample_rate), sample_rate, chunk_size, speed, trailing_silence)
+
+class WavDirectorySource(AudioSource):
+    """Replays every WAV file of a directory in name order, separated by `gap_seconds` of silence.
+
+    Clips may be grouped in `<directory>/<label>/*.wav`, e.g. by expected action. `clips`
+    lists (label, path, start sample, end sample) in playback order for benchmarks.
+    """
+    def __init__(self, directory: str, sample_rate=16000, chunk_size=512, speed=1.0, gap_seconds=2.0):
+        super().__init__(sample_rate, chunk_size, speed)
+        self.gap_seconds = gap_seconds
+        self.clips = []
+        paths = []
+        for root, _, file_names in os.walk(directory):
+            paths.extend(os.path.join(root, name) for name in file_names if name.endswith(".wav"))
+        position = 0
+        gap = int(gap_seconds * sample_rate)
+        for path in sorted(paths):
+            length = len(read_wav(path, sample_rate))
+            label = os.path.dirname(os.path.relpath(path, directory)) or None
+            self.clips.append((label, path, position, position + length))
+            position += length + gap
+
+    @property
+    def duration(self) -> float:
+        return (self.clips[-1][3] if self.clips else 0) / self.sample_rate + self.gap_seconds
+
+    def _generate(self):
+        gap = np.zeros(int(self.gap_seconds * self.sample_rate), dtype=np.int16)
+        for _, path, _, _ in self.clips:
+            yield read_wav(path, self.sample_rate)
+            yield gap
+        yield np.zeros(self.chunk_size, dtype=np.int16)
+
+class SyntheticSource(AudioSource):
+    """Alternates bursts of noise or a tone with silence, for load tests without recordings."""
+    def __init__(self, seconds=60.0, burst_seconds=1.0, gap_seconds=2.0, kind="noise", level=0.3,
+                 sample_rate=16000, chunk_size=512, speed=1.0, seed=0):
+        super().__init__(sample_rate, chunk_size, speed)
+        self.seconds = seconds
+        self.burst_seconds = burst_seconds
+        self.gap_seconds = gap_seconds
+        self.kind = kind
+        self.level = level
+        self.rng = np.random.default_rng(seed)
+
+    def _generate(self):
+        burst = int(self.burst_seconds * self.sample_rate)
+        gap = np.zeros(int(self.gap_seconds * self.sample_rate), dtype=np.int16)
+        produced = 0
+        while produced < self.seconds * self.sample_rate:
+            if self.kind == "tone":
+                signal = np.sin(2 * np.pi * 220 * np.arange(burst) / self.sample_rate)
+            else:
+                signal = self.rng.standard_normal(burst).clip(-3, 3) / 3
+            yield (signal * self.level * 32767).astype(np.int16)
+            yield gap
+            produced += burst + len(gap)
@@ -0,0 +1,106 @@
+import os
+import sys
+import wave
+from time import perf_counter
+
+import numpy as np
+
+from ModelLoader import ASR_BACKENDS, VAD_BACKENDS, load_phowhisper, load_silero_vad
+
+def read_clip(path: str) -> np.ndarray:
+    """Reads a 16 kHz mono 16-bit WAV file as normalized float32."""
+    with wave.open(path, "rb") as wav:
+        if wav.getframerate() != 16000 or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+        pcm16 = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    return pcm16.astype(np.float32) / 32768.0
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    reference_words = reference.lower().split()
+    hypothesis_words = hypothesis.lower().split()
+    distances = np.arange(len(hypothesis_words) + 1)
+    for i, reference_word in enumerate(reference_words, 1):
+        previous = distances.copy()
+        distances[0] = i
+        for j, hypothesis_word in enumerate(hypothesis_words, 1):
+            distances[j] = min(previous[j] + 1, distances[j - 1] + 1, previous[j - 1] + (reference_word != hypothesis_word))
+    return distances[-1] / max(len(reference_words), 1)
+
+def vad_probabilities(model, audio: np.ndarray, chunk_size=512) -> list[float]:
+    import torch
+    model.reset_states()
+    probs = []
+    with torch.inference_mode():
+        for start in range(0, len(audio) - chunk_size + 1, chunk_size):
+            probs.append(model(torch.from_numpy(audio[start:start + chunk_size]), 16000).item())
+    return probs
+
+if __name__ == "__main__":
+    # Usage: python BackendBenchmark.py <clips dir> [num_threads]
+    # Each <clip>.wav may come with a <clip>.txt reference transcription, otherwise the
+    # fp32 PyTorch output is used as the reference.
+    clips_dir = sys.argv[1] if len(sys.argv) > 1 else "clips"
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    clip_names = sorted(name for name in os.listdir(clips_dir) if name.endswith(".wav"))
+    clips = {name: read_clip(os.path.join(clips_dir, name)) for name in clip_names}
+    total_seconds = sum(len(audio) for audio in clips.values()) / 16000
+
+    vad_results = []
+    reference_probs = None
+    for backend in VAD_BACKENDS:
+        model = load_silero_vad(backend=backend, num_threads=num_threads)
+        start_time = perf_counter()
+        probs = np.array([prob for audio in clips.values() for prob in vad_probabilities(model, audio)])
+        elapsed = perf_counter() - start_time
+        if reference_probs is None:
+            reference_probs = probs
+        vad_results.append({
+            "backend": backend,
+            "ms_per_frame": elapsed / max(len(probs), 1) * 1000,
+            "max_diff": float(np.max(np.abs(probs - reference_probs))) if len(probs) else 0.0,
+            "agreement": float(np.mean((probs > 0.5) == (reference_probs > 0.5))) if len(probs) else 1.0,
+        })
+
+    asr_results = []
+    references = {}
+    for name in clip_names:
+        transcript_path = os.path.join(clips_dir, name[:-4] + ".txt")
+        if os.path.exists(transcript_path):
+            with open(transcript_path, encoding="utf-8") as file:
+                references[name] = file.read().strip()
+    for backend in ASR_BACKENDS:
+        try:
+            transcriber = load_phowhisper(backend=backend, num_threads=num_threads)
+        except ImportError as error:
+            print(f"Skipping {backend}: {error}")
+            continue
+        transcriber(np.zeros(16000, dtype=np.float32))  # Warmup
+        errors = []
+        start_time = perf_counter()
+        for name, audio in clips.items():
+            text = transcriber(audio)["text"].strip()
+            references.setdefault(name, text)
+            errors.append(word_error_rate(references[name], text))
+        elapsed = perf_counter() - start_time
+        asr_results.append({
+            "backend": backend,
+            "seconds_per_clip": elapsed / max(len(clips), 1),
+            "rtf": elapsed / max(total_seconds, 1e-9),
+            "wer": float(np.mean(errors)) if errors else 0.0,
+        })
+        del transcriber
+
+    md_lines = []
+    md_lines.append(f"\n## Inference Backends ({len(clips)} clips, {total_seconds:.1f} s, threads: {num_threads or 'default'})\n")
+    md_lines.append("| VAD Backend | ms / frame | Max prob. diff | Decision agreement |\n")
+    md_lines.append("|-------------|------------|----------------|--------------------|\n")
+    for result in vad_results:
+        md_lines.append(f"| {result['backend']:<11} | {result['ms_per_frame']:.3f} | {result['max_diff']:.4f} | {result['agreement']:.2%} |\n")
+    md_lines.append("\n| ASR Backend | s / clip | Real-time factor | WER |\n")
+    md_lines.append("|-------------|----------|------------------|-----|\n")
+    for result in asr_results:
+        md_lines.append(f"| {result['backend']:<11} | {result['seconds_per_clip']:.2f} | {result['rtf']:.3f} | {result['wer']:.2%} |\n")
+    print("".join(md_lines))
+
+    with open("Benchmark.md", "a", encoding="utf-8") as file:
+        file.writelines(md_lines)
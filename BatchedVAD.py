@@ -0,0 +1,104 @@
+import numpy as np
+import torch
+
+class BatchedVAD:
+    """Collects audio chunks into a preallocated ring buffer and runs Silero VAD over them in batches.
+
+    Silero VAD keeps a recurrent state between calls, so the frames of a batch are still fed
+    in order, but they share one inference_mode context and one device sync at the end.
+    With an EnergyGate, frames it finds clearly silent are not scored and get probability 0.
+    """
+    def __init__(self, vad_model, sample_rate=16000, chunk_size=512, batch_size=4, capacity=64, gate=None):
+        if capacity < batch_size:
+            raise ValueError("capacity must be at least batch_size")
+        self.vad_model = vad_model
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.capacity = capacity
+
+        self.ring = np.zeros((capacity, chunk_size), dtype=np.float32)
+        # Shares memory with self.ring, so frames never go through torch.from_numpy one by one
+        self.ring_tensor = torch.from_numpy(self.ring)
+        self.head = 0      # Next slot to write
+        self.pending = 0   # Frames written but not scored yet
+        self.gate = gate
+
+    def push(self, audio_chunk: bytes):
+        """Converts a PyAudio int16 chunk to float32 in place in the next ring slot."""
+        if self.pending == self.capacity:
+            raise OverflowError("VAD ring buffer is full, call flush() first")
+        pcm16 = np.frombuffer(audio_chunk, dtype=np.int16)
+        np.multiply(pcm16, 1 / 32768.0, out=self.ring[self.head], casting="unsafe")
+        self.head = (self.head + 1) % self.capacity
+        self.pending += 1
+
+    def ready(self) -> bool:
+        return self.pending >= self.batch_size
+
+    def flush(self) -> list[tuple[np.ndarray, float]]:
+        """Scores all pending frames and returns (frame, speech probability) pairs in order.
+
+        The returned frames are views into the ring buffer and are overwritten after
+        `capacity` more pushes, copy them if they need to live longer.
+        """
+        if self.pending == 0:
+            return []
+        start = (self.head - self.pending) % self.capacity
+        slots = [(start + i) % self.capacity for i in range(self.pending)]
+        self.pending = 0
+        if self.gate is not None:
+            admitted = self.gate.classify(self.ring[slots])
+            scored = [slot for slot, admit in zip(slots, admitted) if admit]
+        else:
+            scored = slots
+        probs = dict.fromkeys(slots, 0.0)
+        if scored:
+            with torch.inference_mode():
+                outs = [self.vad_model(self.ring_tensor[slot], self.sample_rate) for slot in scored]
+                probs.update(zip(scored, torch.cat(outs).flatten().tolist()))
+        return [(self.ring[slot], probs[slot]) for slot in slots]
+
+if __name__ == "__main__":
+    from time import perf_counter
+    vad_model, _ = torch.hub.load('snakers4/silero-vad', 'silero_vad')
+    chunks = [(np.random.randn(512) * 3000).astype(np.int16).tobytes() for _ in range(500)]
+
+    vad_model.reset_states()
+    start_time = perf_counter()
+    per_frame = []
+    for chunk in chunks:
+        audio_np = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
+        per_frame.append(vad_model(torch.from_numpy(audio_np), 16000).item())
+    per_frame_time = perf_counter() - start_time
+
+    vad_model.reset_states()
+    vad = BatchedVAD(vad_model, batch_size=8)
+    start_time = perf_counter()
+    batched = []
+    for chunk in chunks:
+        vad.push(chunk)
+        if vad.ready():
+            batched.extend(prob for _, prob in vad.flush())
+    batched.extend(prob for _, prob in vad.flush())
+    batched_time = perf_counter() - start_time
+
+    print(f"Per-frame: {per_frame_time / len(chunks) * 1000:.3f} ms/frame")
+    print(f"Batched:   {batched_time / len(chunks) * 1000:.3f} ms/frame")
+    print(f"Max probability difference: {np.max(np.abs(np.array(per_frame) - np.array(batched))):.2e}")
+
+    # An idle room: faint noise only, with and without the energy gate in front of the model
+    from EnergyGate import EnergyGate
+    idle = [(np.random.randn(512) * 30).astype(np.int16).tobytes() for _ in range(2000)]
+    for gate in (None, EnergyGate(512 / 16000)):
+        vad_model.reset_states()
+        vad = BatchedVAD(vad_model, batch_size=8, gate=gate)
+        start_time = perf_counter()
+        for chunk in idle:
+            vad.push(chunk)
+            if vad.ready():
+                vad.flush()
+        vad.flush()
+        idle_time = perf_counter() - start_time
+        skipped = f", {gate.skip_ratio:.1%} of frames skipped" if gate is not None else ""
+        print(f"Idle {'gated' if gate is not None else 'ungated'}: {idle_time / len(idle) * 1000:.3f} ms/frame{skipped}")
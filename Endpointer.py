@@ -0,0 +1,98 @@
+from KeywordMatcher import KeywordMatcher, remove_filler_words, tokenize
+
+class FixedEndpointer:
+    """Ends an utterance after `silence_timeout` seconds of frames below the speech threshold."""
+    def __init__(self, frame_seconds: float, speech_threshold=0.5, silence_timeout=1.0):
+        self.frame_seconds = frame_seconds
+        self.speech_threshold = speech_threshold
+        self.silence_timeout = silence_timeout
+        self.reason = "timeout"
+        self.start()
+
+    def start(self):
+        """Resets the state at the first speech frame of an utterance."""
+        self.silence_frames = 0
+
+    def required_silence(self) -> float:
+        return self.silence_timeout
+
+    def update(self, speech_prob: float) -> bool:
+        """Feeds one frame of the utterance and returns True once it is over."""
+        if speech_prob > self.speech_threshold:
+            self.silence_frames = 0
+            return False
+        # Count silence in audio time so batching does not shift the timeout
+        self.silence_frames += 1
+        return self.silence_frames * self.frame_seconds > self.required_silence()
+
+    def on_partial(self, text: str):
+        pass
+
+    def set_keywords(self, keywords):
+        pass
+
+class AdaptiveEndpointer(FixedEndpointer):
+    """Picks the trailing silence per utterance instead of always waiting `silence_timeout`.
+
+    - `min_silence` once the partial transcript ends with a complete action keyword,
+    - `fast_silence` when the VAD probability dropped cleanly (mean below `clear_prob`),
+    - `max_silence` when it hovers under the threshold (hesitation, trailing words) or
+      the utterance is shorter than `min_speech_seconds`, e.g. a breath before a command,
+    - `silence_timeout` otherwise.
+    """
+    def __init__(self, frame_seconds: float, speech_threshold=0.5, silence_timeout=1.0, keywords=(),
+                 min_silence=0.25, fast_silence=0.5, max_silence=1.5, min_speech_seconds=0.3,
+                 clear_prob=0.1, hesitation_prob=0.25):
+        self.min_silence = min_silence
+        self.fast_silence = fast_silence
+        self.max_silence = max_silence
+        self.min_speech_seconds = min_speech_seconds
+        self.clear_prob = clear_prob
+        self.hesitation_prob = hesitation_prob
+        self.matcher = KeywordMatcher()
+        self.set_keywords(keywords)
+        super().__init__(frame_seconds, speech_threshold, silence_timeout)
+
+    def set_keywords(self, keywords):
+        self.matcher.build([(keyword, keyword) for keyword in keywords])
+
+    def start(self):
+        super().start()
+        self.speech_frames = 0
+        self.silence_prob_sum = 0.0
+        self.keyword_complete = False
+
+    def on_partial(self, text: str):
+        """Notes whether the latest partial transcript ends with a complete keyword, fillers aside."""
+        syllables = tokenize(remove_filler_words(text))
+        self.keyword_complete = any(match.end == len(syllables) for match in self.matcher.find_all(" ".join(syllables)))
+
+    def required_silence(self) -> float:
+        mean_prob = self.silence_prob_sum / self.silence_frames if self.silence_frames else 0.0
+        if self.speech_frames * self.frame_seconds < self.min_speech_seconds:
+            self.reason = "short"
+            return self.max_silence
+        if mean_prob >= self.hesitation_prob:
+            self.reason = "hesitation"
+            return self.max_silence
+        if self.keyword_complete:
+            self.reason = "keyword"
+            return self.min_silence
+        if mean_prob < self.clear_prob:
+            self.reason = "clear"
+            return self.fast_silence
+        self.reason = "timeout"
+        return self.silence_timeout
+
+    def update(self, speech_prob: float) -> bool:
+        if speech_prob > self.speech_threshold:
+            if self.silence_frames:
+                # Speech resumed, an earlier keyword is no longer the end of the command
+                self.keyword_complete = False
+            self.speech_frames += 1
+            self.silence_frames = 0
+            self.silence_prob_sum = 0.0
+            return False
+        self.silence_frames += 1
+        self.silence_prob_sum += speech_prob
+        return self.silence_frames * self.frame_seconds > self.required_silence()
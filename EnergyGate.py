@@ -0,0 +1,63 @@
+import numpy as np
+
+def frame_features(frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """RMS level in dBFS and spectral flatness of every row of a (frames, samples) float32 array.
+
+    Flatness is the geometric over the arithmetic mean of the power spectrum: close to 1
+    for noise, far below it for voiced speech with its harmonics.
+    """
+    frames = np.atleast_2d(frames)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    level_db = 20 * np.log10(rms + 1e-10)
+    power = np.square(np.abs(np.fft.rfft(frames, axis=1)[:, 1:])) + 1e-12
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return level_db, flatness
+
+class EnergyGate:
+    """Skips the neural VAD on frames that are clearly silent.
+
+    A frame is silent when its level is within `margin_db` of the tracked noise floor, or
+    within `margin_db + noise_margin_db` when its spectrum is noise-like (flatness above
+    `flatness_threshold`), or below `silence_db`. The floor follows quieter frames at once
+    and rises at most `rise_db_per_second`, so it adapts to a louder room but not to speech.
+    Every frame above the floor keeps the gate open for `hangover_seconds`, so the VAD still
+    decides the onsets and trailing silence of speech.
+    """
+    def __init__(self, frame_seconds: float, margin_db=6.0, noise_margin_db=6.0, flatness_threshold=0.4,
+                 silence_db=-65.0, rise_db_per_second=1.0, hangover_seconds=0.5):
+        self.margin_db = margin_db
+        self.noise_margin_db = noise_margin_db
+        self.flatness_threshold = flatness_threshold
+        self.silence_db = silence_db
+        self.rise_db_per_frame = rise_db_per_second * frame_seconds
+        self.hangover_frames = int(round(hangover_seconds / frame_seconds))
+        self.floor_db = None
+        self.open_frames = 0
+        self.admitted = 0
+        self.skipped = 0
+
+    def admit(self, level_db: float, flatness: float) -> bool:
+        """Updates the noise floor with one frame and returns True if the VAD should score it."""
+        if self.floor_db is None or level_db < self.floor_db:
+            self.floor_db = max(level_db, self.silence_db)
+        else:
+            self.floor_db += min(level_db - self.floor_db, self.rise_db_per_frame)
+        margin = self.margin_db + (self.noise_margin_db if flatness > self.flatness_threshold else 0.0)
+        if level_db >= self.silence_db and level_db >= self.floor_db + margin:
+            self.open_frames = self.hangover_frames
+        elif self.open_frames:
+            self.open_frames -= 1
+        else:
+            self.skipped += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def classify(self, frames: np.ndarray) -> np.ndarray:
+        """Admission mask for consecutive frames of one stream."""
+        level_db, flatness = frame_features(frames)
+        return np.array([self.admit(level, flat) for level, flat in zip(level_db.tolist(), flatness.tolist())], dtype=bool)
+
+    @property
+    def skip_ratio(self) -> float:
+        return self.skipped / max(self.admitted + self.skipped, 1)
@@ -0,0 +1,75 @@
+from queue import Queue
+from threading import Thread
+from time import sleep, process_time, perf_counter
+
+from AudioSource import AudioSource, SyntheticSource
+
+def busy_wait_consumer(audio_queue: Queue, state: dict):
+    """The old process_audio loop: spins on empty() while the room is silent."""
+    while state["running"]:
+        if not audio_queue.empty():
+            audio_queue.get()
+
+def measure_idle_cpu(consumer, duration=3.0):
+    """Returns the CPU usage (in % of one core) of the consumer while no audio arrives."""
+    audio_queue = Queue()
+    state = {"running": True}
+    worker = Thread(target=consumer, args=(audio_queue, state), daemon=True)
+    cpu_start = process_time()
+    wall_start = perf_counter()
+    worker.start()
+    sleep(duration)
+    state["running"] = False
+    audio_queue.put(None)
+    worker.join()
+    return (process_time() - cpu_start) / (perf_counter() - wall_start) * 100
+
+class NoAudioSource(AudioSource):
+    """An input that delivers no chunks at all, so process_audio only wakes on its poll timeout."""
+    def _generate(self):
+        return iter(())
+
+def measure_assistant_idle_cpu(source: AudioSource, duration=10.0, settle=2.0, **assistant_kwargs):
+    """Returns the CPU usage (in % of one core) of a running VoiceAssistant fed by `source`.
+
+    The real process_audio loop runs, so the VAD batches and the endpointer check done on
+    every chunk or poll timeout are included. The whole process is measured, startup excluded.
+    """
+    from VoiceAssistant import Action, VoiceAssistant
+    actions = [Action("turn_on_light", "Turn on the light", "bật đèn", "bật đèn", lambda: None)]
+    assistant = VoiceAssistant(actions, audio_source=source, num_threads=1, **assistant_kwargs)
+    assistant.start()
+    capture = Thread(target=assistant.process_audio, daemon=True)
+    capture.start()
+    sleep(settle)
+    cpu_start = process_time()
+    wall_start = perf_counter()
+    sleep(duration)
+    cpu = (process_time() - cpu_start) / (perf_counter() - wall_start) * 100
+    assistant.stop()
+    capture.join()
+    return cpu
+
+if __name__ == "__main__":
+    duration = 10.0
+    busy_cpu = measure_idle_cpu(busy_wait_consumer)
+    # A microphone in a silent room still delivers a chunk every 32 ms
+    silent_cpu = measure_assistant_idle_cpu(SyntheticSource(seconds=duration + 10.0, level=0.0), duration)
+    gated_cpu = measure_assistant_idle_cpu(SyntheticSource(seconds=duration + 10.0, level=0.0), duration, energy_gate=True)
+    no_audio_cpu = measure_assistant_idle_cpu(NoAudioSource(), duration)
+    print(f"Busy-wait loop:                      {busy_cpu:.2f}% CPU")
+    print(f"process_audio, silent input:         {silent_cpu:.2f}% CPU")
+    print(f"process_audio, silent input, gated:  {gated_cpu:.2f}% CPU")
+    print(f"process_audio, no input:             {no_audio_cpu:.2f}% CPU")
+
+    md_lines = []
+    md_lines.append(f"\n## Idle CPU Usage (process_audio, {duration:.0f} s without speech, 1 thread)\n")
+    md_lines.append("| Loop                                         | Input                       | CPU (% of one core) |\n")
+    md_lines.append("|----------------------------------------------|-----------------------------|---------------------|\n")
+    md_lines.append(f"| Busy-wait (`empty()`), old loop reproduced   | none                        | {busy_cpu:.2f}% |\n")
+    md_lines.append(f"| VoiceAssistant.process_audio                 | silence, a chunk every 32 ms | {silent_cpu:.2f}% |\n")
+    md_lines.append(f"| VoiceAssistant.process_audio, energy gate    | silence, a chunk every 32 ms | {gated_cpu:.2f}% |\n")
+    md_lines.append(f"| VoiceAssistant.process_audio                 | none, poll timeouts only    | {no_audio_cpu:.2f}% |\n")
+
+    with open("Benchmark.md", "a", encoding="utf-8") as file:
+        file.writelines(md_lines)
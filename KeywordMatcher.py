@@ -0,0 +1,139 @@
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+# Common Vietnamese paraphrases used to generate extra variants of each action's keyword
+SYNONYMS = {
+    "bật": ["mở"],
+    "tắt": ["ngắt"],
+    "đèn": ["bóng đèn"],
+    "điều hòa": ["máy lạnh"],
+    "ti vi": ["tivi", "tv"],
+    "phát": ["mở", "bật"],
+    "dừng": ["tạm dừng", "ngừng", "tắt"],
+}
+
+def strip_diacritics(text: str) -> str:
+    text = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(char for char in text if unicodedata.category(char) != "Mn")
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text.lower()))
+
+# Politeness and filler words that carry no meaning for the classification
+FILLER_WORDS = ["làm ơn", "vui lòng", "giúp tôi", "cho tôi", "hãy", "giúp", "đi", "lên", "nhé"]
+
+def remove_filler_words(text: str) -> str:
+    """Lowercases the text and drops filler words, comparing them without diacritics."""
+    fillers = sorted((strip_diacritics(filler).split() for filler in FILLER_WORDS), key=len, reverse=True)
+    syllables = tokenize(text)
+    stripped = [strip_diacritics(syllable) for syllable in syllables]
+    kept = []
+    i = 0
+    while i < len(syllables):
+        filler = next((filler for filler in fillers if stripped[i:i + len(filler)] == filler), None)
+        if filler is None:
+            kept.append(syllables[i])
+            i += 1
+        else:
+            i += len(filler)
+    return " ".join(kept)
+
+def expand_synonyms(text: str, synonyms=SYNONYMS, rounds=2) -> set[str]:
+    """Returns the text and its synonym variants, e.g. "bật điều hòa" also yields "mở máy lạnh"."""
+    texts = {text.lower()}
+    for _ in range(rounds):
+        for variant in list(texts):
+            for word, replacements in synonyms.items():
+                if re.search(rf"\b{re.escape(word)}\b", variant):
+                    texts.update(re.sub(rf"\b{re.escape(word)}\b", replacement, variant) for replacement in replacements)
+    return texts
+
+@dataclass
+class KeywordMatch:
+    start: int        # First matched syllable
+    end: int          # One past the last matched syllable
+    value: Any
+    exact: bool       # Diacritics match, not only the diacritic-free form
+    original: bool    # The pattern is the keyword itself, not a synonym variant
+
+    @property
+    def rank(self):
+        """Longer, diacritic-exact, original keywords win over shorter or looser matches."""
+        return (self.end - self.start, self.exact, self.original, -self.start)
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over Vietnamese syllables.
+
+    All keywords are matched in a single pass over the command, so the cost depends on the
+    command length rather than on the number of actions. Syllables are compared without
+    diacritics, and matches remember whether the diacritics agreed as well.
+    """
+    def __init__(self, synonyms=SYNONYMS):
+        self.synonyms = synonyms
+        self.build([])
+
+    def build(self, keywords: list[tuple[str, Any]]):
+        """Compiles (keyword, value) pairs, expanding each keyword with its synonym variants."""
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]   # (syllables with diacritics, value, original) per node
+        for keyword, value in keywords:
+            original = " ".join(tokenize(keyword))
+            for variant in sorted(expand_synonyms(keyword, self.synonyms)):
+                syllables = tokenize(variant)
+                if syllables:
+                    self._add(syllables, value, " ".join(syllables) == original)
+
+        # Breadth-first pass to set failure links and merge outputs along them
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for syllable, child in self.goto[node].items():
+                queue.append(child)
+                if node:
+                    fallback = self.fail[node]
+                    while fallback and syllable not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(syllable, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def _add(self, syllables: list[str], value, original: bool):
+        node = 0
+        for syllable in syllables:
+            key = strip_diacritics(syllable)
+            if key not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[node][key] = len(self.goto) - 1
+            node = self.goto[node][key]
+        self.outputs[node].append((syllables, value, original))
+
+    def find_all(self, text: str) -> list[KeywordMatch]:
+        syllables = tokenize(text)
+        matches = []
+        node = 0
+        for position, syllable in enumerate(syllables):
+            key = strip_diacritics(syllable)
+            while node and key not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(key, 0)
+            for pattern, value, original in self.outputs[node]:
+                start = position + 1 - len(pattern)
+                matches.append(KeywordMatch(start, position + 1, value, syllables[start:position + 1] == pattern, original))
+        return matches
+
+    def best(self, text: str) -> KeywordMatch | None:
+        """The most specific match in the text, or None."""
+        return max(self.find_all(text), key=lambda match: match.rank, default=None)
+
+    def non_overlapping(self, text: str) -> list[KeywordMatch]:
+        """The most specific matches that do not overlap each other, in text order."""
+        chosen = []
+        for match in sorted(self.find_all(text), key=lambda match: match.rank, reverse=True):
+            if all(match.end <= other.start or match.start >= other.end for other in chosen):
+                chosen.append(match)
+        return sorted(chosen, key=lambda match: match.start)
@@ -0,0 +1,173 @@
+import os
+import wave
+from threading import Lock
+
+import numpy as np
+
+class KeywordSpotter:
+    """Template-matching keyword spotter that recognizes short fixed commands without ASR.
+
+    Each action keeps a few MFCC templates of its spoken keyword, loaded from WAV files or
+    learned from utterances that ASR already mapped to that action. An utterance is
+    compared to every template with a row-vectorized DTW, and the best action is only
+    returned when it is both close enough and clearly closer than any other action.
+
+    Learned templates are kept apart from the enrolled ones: at most `max_learned` per
+    action, replacing the oldest, and none within `duplicate_distance` of a template the
+    action already has, so a misheard command cannot take over an action.
+    """
+    def __init__(self, sample_rate=16000, n_mfcc=13, n_mels=26, max_templates=5, max_learned=2, threshold=0.7,
+                 margin=0.85, duplicate_distance=0.35, max_seconds=2.0):
+        self.sample_rate = sample_rate
+        self.n_mfcc = n_mfcc
+        self.max_templates = max_templates
+        self.max_learned = max_learned
+        self.duplicate_distance = duplicate_distance
+        self.threshold = threshold   # Maximum normalized DTW distance to accept a match
+        self.margin = margin         # Best distance must be below margin * best distance of another action
+        self.max_samples = int(max_seconds * sample_rate)
+
+        self.frame_length = int(0.025 * sample_rate)
+        self.hop_length = int(0.010 * sample_rate)
+        self.n_fft = 1 << (self.frame_length - 1).bit_length()
+        self.window = np.hamming(self.frame_length).astype(np.float32)
+        self.mel_filters = self._mel_filterbank(n_mels)
+        # DCT-II matrix, keeps coefficients 1..n_mfcc (c0 is loudness)
+        k = np.arange(1, n_mfcc + 1)[:, None]
+        n = np.arange(n_mels)[None, :]
+        self.dct = np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)).astype(np.float32)
+
+        self.lock = Lock()
+        self.templates: dict[str, list[np.ndarray]] = {}
+        self.learned: dict[str, list[np.ndarray]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _mel_filterbank(self, n_mels):
+        def hz_to_mel(hz):
+            return 2595 * np.log10(1 + hz / 700)
+        def mel_to_hz(mel):
+            return 700 * (10 ** (mel / 2595) - 1)
+        mel_points = np.linspace(hz_to_mel(0), hz_to_mel(self.sample_rate / 2), n_mels + 2)
+        bins = np.floor((self.n_fft + 1) * mel_to_hz(mel_points) / self.sample_rate).astype(int)
+        filters = np.zeros((n_mels, self.n_fft // 2 + 1), dtype=np.float32)
+        for i in range(1, n_mels + 1):
+            left, center, right = bins[i - 1], bins[i], bins[i + 1]
+            filters[i - 1, left:center] = (np.arange(left, center) - left) / max(center - left, 1)
+            filters[i - 1, center:right] = (right - np.arange(center, right)) / max(right - center, 1)
+        return filters
+
+    def trim(self, audio: np.ndarray) -> np.ndarray:
+        """Cuts the VAD pre-roll and trailing silence, keeping samples within 30 dB of the loudest 10 ms."""
+        n_blocks = len(audio) // self.hop_length
+        if n_blocks == 0:
+            return audio
+        energy = (audio[:n_blocks * self.hop_length].reshape(n_blocks, -1) ** 2).mean(axis=1)
+        if energy.max() == 0:
+            # Digital silence
+            return audio[:0]
+        voiced = np.flatnonzero(energy > energy.max() * 1e-3)
+        return audio[voiced[0] * self.hop_length:(voiced[-1] + 1) * self.hop_length]
+
+    def features(self, audio: np.ndarray) -> np.ndarray:
+        """Mean and variance normalized MFCCs of a trimmed float32 signal, shape (frames, n_mfcc)."""
+        if len(audio) < self.frame_length:
+            audio = np.pad(audio, (0, self.frame_length - len(audio)))
+        n_frames = 1 + (len(audio) - self.frame_length) // self.hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(audio, self.frame_length)[::self.hop_length][:n_frames]
+        spectrum = np.abs(np.fft.rfft(frames * self.window, n=self.n_fft)) ** 2
+        mfcc = np.log(spectrum @ self.mel_filters.T + 1e-10) @ self.dct.T
+        mfcc -= mfcc.mean(axis=0)
+        return mfcc / (mfcc.std(axis=0) + 1e-5)
+
+    def dtw(self, query: np.ndarray, template: np.ndarray) -> float:
+        """DTW distance with steps (1,0), (1,1), (1,2), so each query row is one vectorized update."""
+        n, m = len(query), len(template)
+        if m > 2 * n or n > 2 * m:
+            return np.inf
+        cost = np.sqrt(((query[:, None, :] - template[None, :, :]) ** 2).mean(axis=2))
+        total = np.full(m, np.inf)
+        total[0] = cost[0, 0]
+        for i in range(1, n):
+            previous = total
+            total = previous.copy()
+            total[1:] = np.minimum(total[1:], previous[:-1])
+            total[2:] = np.minimum(total[2:], previous[:-2])
+            total += cost[i]
+        return total[-1] / n
+
+    def enroll(self, action_name: str, audio: np.ndarray):
+        """Adds a template for an action, keeping only the most recent max_templates."""
+        audio = self.trim(audio)
+        if not 0 < len(audio) <= self.max_samples:
+            return
+        feature = self.features(audio)
+        with self.lock:
+            templates = self.templates.setdefault(action_name, [])
+            templates.append(feature)
+            del templates[:-self.max_templates]
+
+    def learn(self, action_name: str, audio: np.ndarray) -> bool:
+        """Adds a template from an utterance ASR mapped to the action, False if it was a near duplicate."""
+        audio = self.trim(audio)
+        if not 0 < len(audio) <= self.max_samples:
+            return False
+        feature = self.features(audio)
+        with self.lock:
+            existing = self.templates.get(action_name, []) + self.learned.get(action_name, [])
+        if any(self.dtw(feature, template) < self.duplicate_distance for template in existing):
+            return False
+        with self.lock:
+            learned = self.learned.setdefault(action_name, [])
+            learned.append(feature)
+            del learned[:-self.max_learned]
+        return True
+
+    def enroll_directory(self, directory: str):
+        """Loads templates from `directory/<action name>/*.wav` (16-bit mono)."""
+        if not os.path.isdir(directory):
+            return
+        for action_name in os.listdir(directory):
+            action_dir = os.path.join(directory, action_name)
+            if not os.path.isdir(action_dir):
+                continue
+            for file_name in sorted(os.listdir(action_dir)):
+                if file_name.endswith(".wav"):
+                    with wave.open(os.path.join(action_dir, file_name), "rb") as wav:
+                        pcm16 = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+                    self.enroll(action_name, pcm16.astype(np.float32) / 32768.0)
+
+    def retain(self, action_names):
+        """Drops templates of actions that no longer exist."""
+        with self.lock:
+            for templates in (self.templates, self.learned):
+                for name in list(templates):
+                    if name not in action_names:
+                        del templates[name]
+
+    def spot(self, audio: np.ndarray) -> str | None:
+        """Returns the matching action name, or None when ASR should decide."""
+        audio = self.trim(audio)
+        if not 0 < len(audio) <= self.max_samples:
+            self.misses += 1
+            return None
+        with self.lock:
+            templates = {name: self.templates.get(name, []) + self.learned.get(name, [])
+                         for name in self.templates.keys() | self.learned.keys()}
+            templates = {name: features for name, features in templates.items() if features}
+        if not templates:
+            self.misses += 1
+            return None
+
+        query = self.features(audio)
+        distances = {name: min(self.dtw(query, template) for template in features)
+                     for name, features in templates.items()}
+        ranked = sorted(distances.items(), key=lambda item: item[1])
+        best_name, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else np.inf
+        if best < self.threshold and best < self.margin * runner_up:
+            self.hits += 1
+            return best_name
+        self.misses += 1
+        return None
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import random
+import re
+from collections import deque
+from threading import Lock, local
+from time import perf_counter, sleep, time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling the LLM while the circuit breaker is open."""
+
+class FallbackFlag(local):
+    """Per-thread marker a selector sets when it answered from its keyword fallback.
+
+    Fallback answers stand in for an LLM that was down or slow, so caches must not keep them.
+    """
+    used = False
+
+class SelectorFallback:
+    """Answers from keywords when Ollama is down, too slow or the circuit breaker is open.
+
+    Wraps the keyword selector of an LLM selector. Every answer it gives is marked in a
+    per-thread `flag`, so caches skip it; with `enabled=False` the error is returned instead.
+    """
+    def __init__(self, selector, enabled=True):
+        self.selector = selector
+        self.enabled = enabled
+        self.flag = FallbackFlag()
+
+    def update_actions(self, new_actions):
+        self.selector.update_actions(new_actions)
+
+    def answer(self, user_command: str, error: Exception, multiple=False):
+        if not self.enabled:
+            return f"Error: {error}"
+        print(f"LLM request failed ({error}), falling back to keyword matching.")
+        self.flag.used = True
+        if multiple:
+            return self.selector.generate_actions(user_command)
+        return self.selector.generate_action(user_command)
+
+class OllamaClient:
+    """Pooled keep-alive HTTP client for the Ollama API, shared by the LLM selectors.
+
+    - One requests.Session keeps TCP connections alive between commands.
+    - Every request has a (connect, read) timeout, so a hung Ollama cannot block forever.
+    - Connection errors, connect timeouts and 5xx responses are retried with jittered exponential
+      backoff. A read timeout is not retried: a server that hung once will likely hang again.
+    - Retries stop at `deadline` seconds after the call started and their read timeout is cut
+      to what is left of it, so a call never blocks much longer than that.
+    - After `failure_threshold` consecutive failed or slow calls the circuit opens and calls
+      fail fast with CircuitOpenError for `reset_timeout` seconds, then one trial call is let
+      through to decide whether to close it again.
+    """
+    def __init__(self, timeout=(2.0, 30.0), retries=2, backoff=0.2, pool_size=8, deadline=30.0,
+                 failure_threshold=3, reset_timeout=30.0, slow_call_seconds=5.0, latency_window=1000):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.async_sessions = {}   # event loop -> aiohttp.ClientSession
+
+        self.lock = Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False   # The one call let through while half-open has not returned yet
+        self.latencies = deque(maxlen=latency_window)
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.opened_at is not None and time() - self.opened_at < self.reset_timeout
+
+    def _before_call(self) -> bool:
+        """Counts a call or rejects it while the circuit is open, returns True for the half-open trial call."""
+        with self.lock:
+            trial = False
+            if self.opened_at is not None:
+                if time() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError("LLM circuit breaker is open")
+                # Half-open: only this call goes through, the others are rejected until it returns
+                self.trial_in_flight = trial = True
+            self.calls += 1
+            return trial
+
+    def _after_call(self, seconds: float, ok: bool, trial=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            if trial:
+                self.trial_in_flight = False
+            if ok and seconds <= self.slow_call_seconds:
+                self.consecutive_failures = 0
+                if trial:
+                    self.opened_at = None
+                return
+            if trial:
+                # The server is still failing or slow, stay open for another reset_timeout
+                self.failures += 0 if ok else 1
+                self.opened_at = time()
+                return
+            self.failures += 0 if ok else 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time()
+
+    def _retry_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        if isinstance(error, requests.exceptions.ReadTimeout):
+            return False
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def _attempt_timeout(self, attempt: int, start: float) -> tuple[float, float]:
+        """(connect, read) timeout of an attempt, the read timeout of a retry cut to what is left of the deadline."""
+        connect, read = self.timeout
+        if attempt == 0:
+            return connect, read
+        return connect, max(0.1, min(read, self.deadline - (perf_counter() - start)))
+
+    def _past_deadline(self, start: float, delay: float) -> bool:
+        """True when a retry after `delay` seconds could not even connect before the deadline."""
+        return perf_counter() - start + delay + self.timeout[0] >= self.deadline
+
+    def post(self, url: str, data: dict) -> dict:
+        """POSTs JSON and returns the decoded response, raising RequestException on failure."""
+        trial = self._before_call()
+        start = perf_counter()
+        ok = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = self.session.post(url, json=data, timeout=self._attempt_timeout(attempt, start))
+                    response.raise_for_status()
+                    result = response.json()
+                    break
+                except requests.exceptions.RequestException as error:
+                    delay = self._retry_delay(attempt)
+                    if attempt == self.retries or not self._retryable(error) or self._past_deadline(start, delay):
+                        raise
+                    sleep(delay)
+            ok = True
+        finally:
+            # Also on unexpected errors, so a half-open trial can never stay in flight
+            self._after_call(perf_counter() - start, ok, trial)
+        return result
+
+    async def post_async(self, url: str, data: dict) -> dict:
+        """Async variant of post(), pooled through aiohttp when it is installed."""
+        try:
+            import aiohttp
+        except ImportError:
+            return await asyncio.to_thread(self.post, url, data)
+
+        loop = asyncio.get_running_loop()
+        # Sessions of loops that were closed without close() would keep those loops alive
+        for closed_loop in [other for other in self.async_sessions if other.is_closed()]:
+            del self.async_sessions[closed_loop]
+        session = self.async_sessions.get(loop)
+        if session is None or session.closed:
+            connect, read = self.timeout
+            session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+            self.async_sessions[loop] = session
+
+        trial = self._before_call()
+        start = perf_counter()
+        ok = False
+        try:
+            for attempt in range(self.retries + 1):
+                connect, read = self._attempt_timeout(attempt, start)
+                try:
+                    async with session.post(url, json=data, timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)) as response:
+                        response.raise_for_status()
+                        result = await response.json()
+                        break
+                except aiohttp.ClientError as error:
+                    server_error = isinstance(error, aiohttp.ClientResponseError) and error.status >= 500
+                    # ServerTimeoutError is a read timeout, not worth another attempt
+                    connection_error = isinstance(error, aiohttp.ClientConnectionError) and not isinstance(error, aiohttp.ServerTimeoutError)
+                    delay = self._retry_delay(attempt)
+                    if attempt == self.retries or not (server_error or connection_error) or self._past_deadline(start, delay):
+                        raise
+                    await asyncio.sleep(delay)
+            ok = True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise requests.exceptions.RequestException(str(error)) from error
+        finally:
+            self._after_call(perf_counter() - start, ok, trial)
+        return result
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)) -> dict:
+        """Per-call latency percentiles in seconds over the most recent calls."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {f"p{p}": None for p in percentiles}
+        return {f"p{p}": latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] for p in percentiles}
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {"calls": self.calls, "failures": self.failures, "rejected": self.rejected,
+                     "circuit_open": self.opened_at is not None}
+        stats.update(self.latency_percentiles())
+        return stats
+
+    def close(self):
+        """Closes the pooled connections, the aiohttp sessions on the loop they belong to."""
+        self.session.close()
+        for loop, session in list(self.async_sessions.items()):
+            if session.closed or loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+            else:
+                loop.run_until_complete(session.close())
+        self.async_sessions.clear()
+
+def enum_format(values: list[str]) -> tuple[dict, int]:
+    """JSON schema that constrains the answer to one of `values`, and the num_predict cap for it.
+
+    Every token is at least one byte, so the longest JSON-encoded value in bytes bounds
+    the tokens needed to decode any of them.
+    """
+    schema = {"type": "string", "enum": list(values)}
+    num_predict = max(len(json.dumps(value, ensure_ascii=False).encode("utf-8")) for value in values)
+    return schema, num_predict
+
+def parse_enum_response(text: str, values) -> str | None:
+    """The value of a constrained answer, None when it was cut short or is not one of `values`."""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if value in values else None
+
+def enum_list_format(values: list[str], max_items: int | None = None) -> tuple[dict, int]:
+    """JSON schema for an ordered list of `values`, and the num_predict cap for it.
+
+    A value may repeat ("on, off, on"), so the list holds up to `max_items` values, twice
+    the number of values by default.
+    """
+    max_items = max_items or 2 * len(values)
+    schema = {"type": "array", "items": {"type": "string", "enum": list(values)}, "maxItems": max_items}
+    # "[" and "]", plus the longest value with its ", " separator for every item
+    num_predict = 2 + max_items * (max(len(json.dumps(value, ensure_ascii=False).encode("utf-8")) for value in values) + 2)
+    return schema, num_predict
+
+def collapse_repeats(items: list) -> list:
+    """Drops immediate repeats: "on, on" is one command, "on, off, on" stays three."""
+    return [item for i, item in enumerate(items) if i == 0 or item != items[i - 1]]
+
+def parse_enum_list_response(text: str, values) -> list[str] | None:
+    """The values of a constrained list answer in order, None when it is not a complete list."""
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(items, list):
+        return None
+    return collapse_repeats([item for item in items if item in values])
+
+def parse_free_list_response(text: str, values) -> list[str]:
+    """Every mention of one of `values` in a free-form answer, in the order they appear."""
+    mentions = sorted((match.start(), value) for value in values for match in re.finditer(re.escape(value), text))
+    return collapse_repeats([value for _, value in mentions])
+
+_default_client = None
+_default_client_lock = Lock()
+
+def get_client() -> OllamaClient:
+    """The process-wide client shared by every LLM selector that was not given its own."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = OllamaClient()
+        return _default_client
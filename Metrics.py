@@ -0,0 +1,214 @@
+import json
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, time
+
+# Upper bounds in seconds, from a VAD frame up to a slow LLM round-trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class LogSink:
+    """Prints one line per observation, in place of the ad-hoc print statements."""
+    def emit(self, event: dict):
+        if event["type"] == "histogram":
+            print(f"[metrics] {event['name']}: {event['value'] * 1000:.1f} ms")
+        else:
+            print(f"[metrics] {event['name']} = {event['value']}")
+
+    def close(self):
+        pass
+
+class JsonlSink:
+    """Appends every observation as a JSON line, flushing every `flush_every` events."""
+    def __init__(self, path: str, flush_every=50):
+        self.file = open(path, "a", encoding="utf-8")
+        self.flush_every = flush_every
+        self.pending = 0
+        self.lock = Lock()
+
+    def emit(self, event: dict):
+        with self.lock:
+            self.file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.file.flush()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class PrometheusSink:
+    """Serves the aggregated metrics in the Prometheus text format on http://<host>:<port>/metrics.
+
+    Only local scrapers by default, pass host="0.0.0.0" to expose the endpoint to the network.
+    """
+    def __init__(self, port=9464, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self.server = None
+
+    def attach(self, metrics):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+
+    def emit(self, event: dict):
+        pass
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+class Metrics:
+    """Timing spans, counters and gauges for the voice pipeline, exported through sinks.
+
+    Spans and observations are aggregated into histograms (for the Prometheus endpoint and
+    `snapshot()`) and forwarded to every sink as they happen. Use NULL_METRICS when
+    telemetry is off, its methods do nothing.
+    """
+    enabled = True
+
+    def __init__(self, sinks=(), buckets=DEFAULT_BUCKETS, prefix="voice_assistant"):
+        self.sinks = list(sinks)
+        self.buckets = buckets
+        self.prefix = prefix
+        self.lock = Lock()
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        for sink in self.sinks:
+            if hasattr(sink, "attach"):
+                sink.attach(self)
+
+    def _emit(self, event: dict):
+        event["time"] = time()
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        self._emit({"type": "histogram", "name": name, "value": seconds})
+
+    @contextmanager
+    def span(self, name: str):
+        """Times the enclosed block into the `name` histogram, also when it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def inc(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            total = self.counters[name]
+        self._emit({"type": "counter", "name": name, "value": total})
+
+    def set_gauge(self, name: str, value: float):
+        with self.lock:
+            changed = self.gauges.get(name) != value
+            self.gauges[name] = value
+        if changed:
+            self._emit({"type": "gauge", "name": name, "value": value})
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "histograms": {name: {"count": h.count, "sum": h.sum, "mean": h.sum / h.count if h.count else None}
+                               for name, h in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+                lines.append(f"{self.prefix}_{name}_total {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class NullMetrics:
+    """Drop-in Metrics that records nothing, so disabled telemetry costs one method call."""
+    enabled = False
+    _span = nullcontext()
+
+    def observe(self, name: str, seconds: float):
+        pass
+
+    def span(self, name: str):
+        return self._span
+
+    def inc(self, name: str, value=1):
+        pass
+
+    def set_gauge(self, name: str, value: float):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"histograms": {}, "counters": {}, "gauges": {}}
+
+    def close(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+if __name__ == "__main__":
+    # Overhead of a span around an empty block, enabled (no sinks) vs disabled
+    iterations = 200000
+    for metrics in (Metrics(), NULL_METRICS):
+        start_time = perf_counter()
+        for _ in range(iterations):
+            with metrics.span("noop"):
+                pass
+        per_span = (perf_counter() - start_time) / iterations * 1e6
+        print(f"{metrics.__class__.__name__}: {per_span:.3f} us per span")
@@ -0,0 +1,254 @@
+import os
+import re
+import shutil
+import tempfile
+import urllib.request
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+CACHE_DIR = os.environ.get("VOICE_ASSISTANT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "voice_assistant"))
+SILERO_VAD_VERSION = "v5.1.2"
+SILERO_VAD_ONNX_URL = "https://github.com/snakers4/silero-vad/raw/{version}/src/silero_vad/data/silero_vad.onnx"
+PHOWHISPER_MODEL = "vinai/PhoWhisper-medium"
+# A branch or tag is resolved to its commit SHA on the first download and recorded, pass a SHA to pin one
+PHOWHISPER_REVISION = "main"
+
+# Silero VAD is only distributed as TorchScript and ONNX, so there is no separate eager backend
+VAD_BACKENDS = ("torchscript", "onnx", "onnx_int8")
+ASR_BACKENDS = ("pytorch", "int8", "onnx", "onnx_int8")
+
+class StartupTimer:
+    """Records how long each startup phase takes and prints a breakdown."""
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - start))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def report(self):
+        print("Startup time breakdown:")
+        for name, seconds in self.phases:
+            print(f"  {name:<24} {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<24} {self.total * 1000:8.1f} ms")
+
+class OnnxSileroVAD:
+    """Runs the Silero VAD ONNX model with ONNX Runtime, callable like the TorchScript model."""
+    context_size = 64
+    state_shape = (2, 1, 128)
+
+    def __init__(self, path: str, num_threads=None):
+        import onnxruntime as ort
+        import torch
+        # BatchedVAD concatenates the outputs with torch.cat, like the TorchScript model returns them
+        self.from_numpy = torch.from_numpy
+        options = ort.SessionOptions()
+        options.inter_op_num_threads = 1
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.reset_states()
+
+    def reset_states(self, batch_size=1):
+        self.state = np.zeros((self.state_shape[0], batch_size, self.state_shape[2]), dtype=np.float32)
+        self.context = np.zeros((batch_size, self.context_size), dtype=np.float32)
+
+    def __call__(self, x, sr: int):
+        """Scores one frame, or a (streams, samples) batch with one recurrent state per row."""
+        x = np.asarray(x, dtype=np.float32)
+        x = x.reshape(1, -1) if x.ndim == 1 else x
+        if len(x) != self.context.shape[0]:
+            # Like the TorchScript model, a new batch size starts from fresh states
+            self.reset_states(len(x))
+        x = np.concatenate([self.context, x], axis=1)
+        out, self.state = self.session.run(None, {"input": x, "state": self.state, "sr": np.array(sr, dtype=np.int64)})
+        self.context = x[:, -self.context_size:]
+        return self.from_numpy(out)
+
+def set_num_threads(num_threads=None):
+    """Limits the intra-op threads used by PyTorch, None keeps the PyTorch default."""
+    if num_threads is not None:
+        import torch
+        torch.set_num_threads(num_threads)
+
+def _versioned_path(*parts, cache_dir=None):
+    path = os.path.join(cache_dir or CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+@contextmanager
+def _atomic_file(path):
+    """Yields a temporary path next to `path` that replaces it only when the block finishes.
+
+    The cache is trusted by existence checks, so an interrupted download or save must
+    never leave a truncated file under the final name.
+    """
+    root, extension = os.path.splitext(path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(root) + ".", suffix=".tmp" + extension)
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+@contextmanager
+def _atomic_dir(path):
+    """Like _atomic_file for a directory, whose config.json marks it as complete."""
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        yield temp_dir
+        if os.path.exists(path):
+            # Left incomplete by an interrupted run, os.replace cannot overwrite a non-empty directory
+            shutil.rmtree(path)
+        os.replace(temp_dir, path)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+def _resolve_revision(model_name, revision, model_root):
+    """The commit SHA of `revision`, looked up on the hub once and then read from `<model_root>/refs/`."""
+    if re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    ref_path = os.path.join(model_root, "refs", revision)
+    if os.path.exists(ref_path):
+        with open(ref_path, encoding="utf-8") as file:
+            return file.read().strip()
+    from huggingface_hub import HfApi
+    sha = HfApi().model_info(model_name, revision=revision).sha
+    os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+    with _atomic_file(ref_path) as temp_path:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(sha)
+    return sha
+
+def _quantize_onnx_dir(source_dir, target_dir):
+    """Writes an int8 dynamically quantized copy of every .onnx file in source_dir, copying the rest."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    os.makedirs(target_dir, exist_ok=True)
+    for file_name in os.listdir(source_dir):
+        source = os.path.join(source_dir, file_name)
+        target = os.path.join(target_dir, file_name)
+        if file_name.endswith(".onnx"):
+            quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+        elif os.path.isfile(source) and not file_name.endswith(".onnx_data"):
+            shutil.copy(source, target)
+
+def load_silero_vad(version=SILERO_VAD_VERSION, cache_dir=None, backend="torchscript", num_threads=None):
+    """Loads Silero VAD from the local cache, downloading it only on the first run.
+
+    The TorchScript module is saved under `<cache_dir>/silero-vad/<version>/` so later
+    starts need neither network access nor the hub repository. The "onnx" backends keep
+    their model files next to it, "onnx_int8" is quantized once from the "onnx" file.
+    """
+    if backend not in VAD_BACKENDS:
+        raise ValueError(f"Unknown VAD backend: {backend}, expected one of {VAD_BACKENDS}")
+    set_num_threads(num_threads)
+    if backend in ("onnx", "onnx_int8"):
+        path = _versioned_path("silero-vad", version, "silero_vad.onnx", cache_dir=cache_dir)
+        if not os.path.exists(path):
+            with _atomic_file(path) as temp_path:
+                urllib.request.urlretrieve(SILERO_VAD_ONNX_URL.format(version=version), temp_path)
+        if backend == "onnx_int8":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            int8_path = _versioned_path("silero-vad", version, "silero_vad_int8.onnx", cache_dir=cache_dir)
+            if not os.path.exists(int8_path):
+                with _atomic_file(int8_path) as temp_path:
+                    quantize_dynamic(path, temp_path, weight_type=QuantType.QInt8)
+            path = int8_path
+        return OnnxSileroVAD(path, num_threads)
+
+    import torch
+    path = _versioned_path("silero-vad", version, "silero_vad.jit", cache_dir=cache_dir)
+    if os.path.exists(path):
+        return torch.jit.load(path, map_location="cpu")
+    model, _ = torch.hub.load(f"snakers4/silero-vad:{version}", "silero_vad", trust_repo=True)
+    with _atomic_file(path) as temp_path:
+        torch.jit.save(model, temp_path)
+    return model
+
+def load_phowhisper(model_name=PHOWHISPER_MODEL, revision=PHOWHISPER_REVISION, cache_dir=None, backend="pytorch", num_threads=None):
+    """Loads the PhoWhisper ASR pipeline from a versioned local copy.
+
+    The first run downloads the model and saves it as safetensors, which transformers
+    memory-maps when loading, so later starts read the weights lazily from disk. The copy
+    lives under `<cache_dir>/asr/<model>/<commit sha>/`, a branch like "main" is resolved
+    to its commit once, so later starts keep using that copy even after the branch moves.
+
+    Backends:
+    - "pytorch": fp32 eager model.
+    - "int8": the eager model with its Linear layers dynamically quantized at load time.
+    - "onnx": exported once with optimum and run with ONNX Runtime.
+    - "onnx_int8": the ONNX export with int8 dynamically quantized weights.
+    """
+    if backend not in ASR_BACKENDS:
+        raise ValueError(f"Unknown ASR backend: {backend}, expected one of {ASR_BACKENDS}")
+    try:
+        from transformers import pipeline
+    except ImportError:
+        raise ImportError("Transformers is not installed. Please use Google ASR instead.")
+    set_num_threads(num_threads)
+
+    model_root = os.path.join(cache_dir or CACHE_DIR, "asr", *model_name.split("/"))
+    revision = _resolve_revision(model_name, revision, model_root)
+    model_dir = os.path.join(model_root, revision)
+    os.makedirs(model_dir, exist_ok=True)
+
+    def load_pytorch():
+        path = os.path.join(model_dir, "model")
+        if os.path.exists(os.path.join(path, "config.json")):
+            return pipeline("automatic-speech-recognition", model=path), path
+        transcriber = pipeline("automatic-speech-recognition", model=model_name, revision=revision)
+        with _atomic_dir(path) as temp_dir:
+            transcriber.save_pretrained(temp_dir, safe_serialization=True)
+        return transcriber, path
+
+    if backend == "pytorch":
+        return load_pytorch()[0]
+    if backend == "int8":
+        import torch
+        transcriber = load_pytorch()[0]
+        transcriber.model = torch.quantization.quantize_dynamic(transcriber.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return transcriber
+
+    try:
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        from transformers import AutoProcessor
+    except ImportError:
+        raise ImportError("The ONNX ASR backends need optimum[onnxruntime]. Please use asr_backend=\"pytorch\" instead.")
+    onnx_path = os.path.join(model_dir, "onnx")
+    if not os.path.exists(os.path.join(onnx_path, "config.json")):
+        # Export once from the cached PyTorch weights, later starts only load the ONNX files
+        transcriber, path = load_pytorch()
+        with _atomic_dir(onnx_path) as temp_dir:
+            ORTModelForSpeechSeq2Seq.from_pretrained(path, export=True).save_pretrained(temp_dir)
+            transcriber.tokenizer.save_pretrained(temp_dir)
+            transcriber.feature_extractor.save_pretrained(temp_dir)
+        del transcriber
+    if backend == "onnx_int8":
+        int8_path = os.path.join(model_dir, "onnx_int8")
+        if not os.path.exists(os.path.join(int8_path, "config.json")):
+            with _atomic_dir(int8_path) as temp_dir:
+                _quantize_onnx_dir(onnx_path, temp_dir)
+        onnx_path = int8_path
+
+    options = ort.SessionOptions()
+    if num_threads is not None:
+        options.intra_op_num_threads = num_threads
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(onnx_path, session_options=options, provider="CPUExecutionProvider")
+    processor = AutoProcessor.from_pretrained(onnx_path)
+    return pipeline("automatic-speech-recognition", model=model,
+                    tokenizer=processor.tokenizer, feature_extractor=processor.feature_extractor)
@@ -0,0 +1,202 @@
+import sys
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+import numpy as np
+
+from AudioSource import SyntheticSource, WavDirectorySource, read_wav
+
+class StageTimer:
+    """Wraps pipeline callables in place and records how long each call takes, per stage."""
+    def __init__(self):
+        self.lock = Lock()
+        self.samples: dict[str, list[float]] = {}
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, owner, name: str, stage: str):
+        original = getattr(owner, name)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, perf_counter() - start)
+        setattr(owner, name, timed)
+
+    def summary(self, stage: str) -> dict:
+        values = np.array(self.samples.get(stage, [])) * 1000
+        if len(values) == 0:
+            return {"count": 0, "mean": None, "p50": None, "p90": None}
+        return {"count": len(values), "mean": values.mean(), "p50": np.percentile(values, 50), "p90": np.percentile(values, 90)}
+
+def speech_end(audio: np.ndarray, sample_rate=16000) -> int:
+    """Sample after the last 10 ms block within 30 dB of the loudest one, where speech ends in a clip."""
+    block = sample_rate // 100
+    n_blocks = len(audio) // block
+    if n_blocks == 0:
+        return len(audio)
+    energy = (audio[:n_blocks * block].astype(np.float32).reshape(n_blocks, -1) ** 2).mean(axis=1)
+    voiced = np.flatnonzero(energy > energy.max() * 1e-3)
+    return (voiced[-1] + 1) * block if len(voiced) else len(audio)
+
+def instrument(assistant, source, timer: StageTimer):
+    """Times every stage of a main.VoiceAssistant and maps its utterances back to source clips."""
+    clips = getattr(source, "clips", [])
+    # Latencies are measured from where speech ends in a clip, not from the silence padding its file
+    speech_ends = [start + speech_end(read_wav(path, source.sample_rate), source.sample_rate) for _, path, start, _ in clips]
+    def clip_end(clip):
+        return source.wall_time(speech_ends[clip])
+    utterances = {}   # utterance_id -> {"clip", "submitted", ...}
+    results = []      # (clip index, action) in commit order
+    processed = [0]   # Samples the recording state machine has consumed
+
+    original_flush = assistant.vad.flush
+    def flush():
+        start = perf_counter()
+        frames = original_flush()
+        if frames:
+            timer.record("VAD (per frame)", (perf_counter() - start) / len(frames))
+        return frames
+    assistant.vad.flush = flush
+
+    original_update = assistant._update_recording
+    def update_recording(audio_np, speech_prob):
+        processed[0] += len(audio_np)
+        return original_update(audio_np, speech_prob)
+    assistant._update_recording = update_recording
+
+    original_submit = assistant.workers.submit
+    def submit(item):
+        now = perf_counter()
+        # The utterance belongs to the clip its audio overlaps most
+        end = processed[0]
+        start = end - len(item[1])
+        overlaps = [min(end, clip_stop) - max(start, clip_start) for _, _, clip_start, clip_stop in clips]
+        clip = max(range(len(clips)), key=overlaps.__getitem__, default=None)
+        if clip is not None and overlaps[clip] <= 0:
+            clip = None
+        utterances[item[0]] = {"clip": clip, "submitted": now}
+        if clip is not None:
+            timer.record("Endpointing + buffering", now - clip_end(clip))
+        return original_submit(item)
+    assistant.workers.submit = submit
+
+    original_process = assistant.workers.process
+    def process(item):
+        now = perf_counter()
+        utterance = utterances[item[0]]
+        timer.record("Queue wait", now - utterance["submitted"])
+        if utterance["clip"] is not None:
+            timer.record("End of speech to ASR", now - clip_end(utterance["clip"]))
+        return item[0], original_process(item)
+    assistant.workers.process = process
+
+    original_commit = assistant.workers.commit
+    def commit(result):
+        utterance_id, action = result if result is not None else (None, None)
+        start = perf_counter()
+        original_commit(action)
+        timer.record("Action", perf_counter() - start)
+        start = perf_counter()
+        assistant.tts.wait()
+        timer.record("TTS playback", perf_counter() - start)
+        clip = utterances.get(utterance_id, {}).get("clip")
+        if clip is not None:
+            timer.record("End to end", perf_counter() - clip_end(clip))
+        results.append((clip, action))
+    assistant.workers.commit = commit
+
+    if assistant.transcriber is not None:
+        timer.wrap(assistant, "transcriber", "ASR")
+    else:
+        timer.wrap(assistant.recognizer, "recognize_google", "ASR")
+    timer.wrap(assistant.action_selector, "generate_actions", "Selection")
+    return results
+
+def wait_until_idle(assistant, timeout=60.0):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        stats = assistant.workers.stats()
+        if not assistant.recording and stats["pending"] == 0 and stats["completed"] + stats["failed"] + stats["dropped"] >= stats["submitted"]:
+            return
+        sleep(0.05)
+
+def run(source, **assistant_kwargs):
+    """Plays the source once through a fresh main.VoiceAssistant and returns its stage timings."""
+    from main import VoiceAssistant
+    assistant = VoiceAssistant(audio_source=source, **assistant_kwargs)
+    timer = StageTimer()
+    results = instrument(assistant, source, timer)
+
+    start_time = perf_counter()
+    assistant.start()
+    capture = Thread(target=assistant.process_audio, daemon=True)
+    capture.start()
+    source.finished.wait()
+    wait_until_idle(assistant)
+    elapsed = perf_counter() - start_time
+    assistant.stop()
+    capture.join()
+    return timer, results, elapsed, assistant.workers.stats()["dropped"]
+
+def accuracy(source, results):
+    labels = [label for label, _, _, _ in getattr(source, "clips", [])]
+    scored = [(labels[clip], actions) for clip, actions in results if clip is not None and labels[clip] is not None]
+    correct = sum(1 for label, actions in scored if actions == [label] or (label == "unknown" and not actions))
+    return correct, len(scored)
+
+if __name__ == "__main__":
+    # Usage: python PipelineBenchmark.py <clips dir | synthetic> [speed] [--google] [--compare-endpointing]
+    # Clips in <clips dir>/<action name>/*.wav are scored against that action,
+    # <clips dir>/unknown/*.wav are expected to select nothing.
+    clips_dir = sys.argv[1] if len(sys.argv) > 1 else "clips"
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else 1.0
+    if clips_dir == "synthetic":
+        source = SyntheticSource(seconds=60.0, speed=speed)
+        audio_seconds = source.seconds
+    else:
+        source = WavDirectorySource(clips_dir, speed=speed)
+        audio_seconds = source.duration
+    use_google = "--google" in sys.argv
+
+    md_lines = []
+    if "--compare-endpointing" in sys.argv:
+        # The same recordings with the fixed silence timeout and with the adaptive endpointer
+        md_lines.append(f"\n## Endpointing ({clips_dir}, {audio_seconds:.1f} s of audio at {speed:g}x)\n")
+        md_lines.append("| Endpointer | Utterances | End of speech to ASR p50 (ms) | p90 (ms) | End to end p50 (ms) | Accuracy |\n")
+        md_lines.append("|------------|------------|-------------------------------|----------|---------------------|----------|\n")
+        for name, adaptive in (("fixed", False), ("adaptive", True)):
+            timer, results, _, _ = run(source, use_google=use_google, adaptive_endpointing=adaptive)
+            to_asr = timer.summary("End of speech to ASR")
+            end_to_end = timer.summary("End to end")
+            correct, total = accuracy(source, results)
+            cells = [f"{summary[key]:.1f}" if summary[key] is not None else "-"
+                     for summary, key in ((to_asr, "p50"), (to_asr, "p90"), (end_to_end, "p50"))]
+            md_lines.append(f"| {name:<10} | {len(results)} | {' | '.join(cells)} | {correct / max(total, 1):.2%} |\n")
+        print("".join(md_lines))
+        with open("Benchmark.md", "a", encoding="utf-8") as file:
+            file.writelines(md_lines)
+        sys.exit()
+
+    timer, results, elapsed, dropped = run(source, use_google=use_google)
+    labels = [label for label, _, _, _ in getattr(source, "clips", [])]
+    correct, scored = accuracy(source, results)
+
+    md_lines.append(f"\n## End-to-End Pipeline ({clips_dir}, {audio_seconds:.1f} s of audio at {speed:g}x)\n")
+    md_lines.append("| Stage                   | Count | Mean (ms) | p50 (ms) | p90 (ms) |\n")
+    md_lines.append("|-------------------------|-------|-----------|----------|----------|\n")
+    for stage in ("VAD (per frame)", "Endpointing + buffering", "Queue wait", "End of speech to ASR", "ASR", "Selection", "Action", "TTS playback", "End to end"):
+        summary = timer.summary(stage)
+        if summary["count"]:
+            md_lines.append(f"| {stage:<23} | {summary['count']} | {summary['mean']:.2f} | {summary['p50']:.2f} | {summary['p90']:.2f} |\n")
+    md_lines.append(f"\n- Utterances: {len(results)} from {len(labels)} clips, {dropped} dropped\n")
+    md_lines.append(f"- Throughput: {len(results) / elapsed:.2f} utterances/s, real-time factor {elapsed / max(audio_seconds, 1e-9):.3f}\n")
+    if scored:
+        md_lines.append(f"- Action accuracy: {correct / scored:.2%} ({correct}/{scored})\n")
+    print("".join(md_lines))
+
+    with open("Benchmark.md", "a", encoding="utf-8") as file:
+        file.writelines(md_lines)
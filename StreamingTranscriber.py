@@ -0,0 +1,101 @@
+from threading import Condition, Thread
+from typing import Callable
+
+import numpy as np
+
+class StreamingTranscriber:
+    """Decodes overlapping windows of an utterance while it is still being spoken.
+
+    The capture thread calls feed() as audio arrives, a background thread decodes the
+    utterance so far (older pending snapshots are skipped, so decoding never falls behind)
+    and reports each partial hypothesis through `on_partial(utterance_id, text, stable_text)`.
+    `stable_text` is the longest word prefix shared by the last two hypotheses, which does
+    not change anymore as the user keeps speaking. Every hypothesis starts at the beginning
+    of the utterance, so the prefix does too; past `max_seconds` partial decoding stops and
+    only the final decoding of the whole utterance runs.
+    """
+    def __init__(self, transcriber: Callable, sample_rate=16000, max_seconds=10.0, step_seconds=0.5, on_partial: Callable[[int, str, str], None] | None = None):
+        self.transcriber = transcriber
+        self.sample_rate = sample_rate
+        self.max_samples = int(max_seconds * sample_rate)
+        self.step_samples = int(step_seconds * sample_rate)
+        self.on_partial = on_partial
+
+        self.cond = Condition()
+        self.latest = None            # (utterance_id, audio) waiting to be decoded
+        self.active_id = None
+        self.fed_samples = 0
+        self.previous_words = []
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = Thread(target=self._decode_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.is_running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def begin_utterance(self, utterance_id: int):
+        with self.cond:
+            self.active_id = utterance_id
+            self.latest = None
+            self.fed_samples = 0
+            self.previous_words = []
+
+    def feed(self, utterance_id: int, audio: np.ndarray):
+        """Queues the utterance so far for decoding once `step_seconds` of new audio arrived."""
+        if len(audio) > self.max_samples:
+            return
+        with self.cond:
+            if utterance_id != self.active_id or len(audio) - self.fed_samples < self.step_samples:
+                return
+            self.fed_samples = len(audio)
+            self.latest = (utterance_id, audio.copy())
+            self.cond.notify_all()
+
+    def is_active(self, utterance_id: int) -> bool:
+        with self.cond:
+            return self.active_id == utterance_id
+
+    def end_utterance(self, utterance_id: int):
+        """Stops partial decoding, the final text comes from decoding the whole utterance."""
+        with self.cond:
+            if self.active_id == utterance_id:
+                self.active_id = None
+                self.latest = None
+
+    def _decode_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.latest is not None or not self.is_running)
+                if not self.is_running:
+                    return
+                utterance_id, audio = self.latest
+                self.latest = None
+
+            try:
+                text = self.transcriber(audio)["text"].strip()
+            except Exception as error:
+                print(f"Partial transcription failed: {error}")
+                continue
+
+            with self.cond:
+                if utterance_id != self.active_id:
+                    # The utterance ended while decoding, drop the stale hypothesis
+                    continue
+                words = text.lower().split()
+                stable = []
+                for previous, current in zip(self.previous_words, words):
+                    if previous != current:
+                        break
+                    stable.append(current)
+                self.previous_words = words
+
+            if self.on_partial is not None:
+                self.on_partial(utterance_id, text, " ".join(stable))
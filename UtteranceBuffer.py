@@ -0,0 +1,106 @@
+import numpy as np
+
+class UtteranceBuffer:
+    """Array-backed store for one utterance: a circular pre-roll plus a growable segment.
+
+    Every sample is kept both as float32 (for PhoWhisper) and int16 PCM (for Google ASR),
+    written in place as frames arrive, so transcription reads a view instead of
+    concatenating and converting the whole utterance.
+    """
+    def __init__(self, sample_rate=16000, chunk_size=512, pre_roll_frames=32, initial_seconds=5.0, max_seconds=30.0):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.max_samples = int(max_seconds * sample_rate)
+
+        self.pre_roll = np.zeros(pre_roll_frames * chunk_size, dtype=np.float32)
+        self.pre_roll_head = 0   # Next sample to write
+        self.pre_roll_count = 0  # Valid samples in the pre-roll
+
+        capacity = min(int(initial_seconds * sample_rate), self.max_samples)
+        self.segment_f32 = np.zeros(capacity, dtype=np.float32)
+        self.segment_i16 = np.zeros(capacity, dtype=np.int16)
+        self.length = 0
+        self.truncated = False
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def capacity(self):
+        return len(self.segment_f32)
+
+    @property
+    def nbytes(self):
+        """Memory held by this buffer, bounded by max_seconds."""
+        return self.pre_roll.nbytes + self.segment_f32.nbytes + self.segment_i16.nbytes
+
+    @property
+    def duration(self):
+        return self.length / self.sample_rate
+
+    def push_pre_roll(self, frame: np.ndarray):
+        """Keeps the most recent frames before speech starts, overwriting the oldest ones."""
+        size = len(self.pre_roll)
+        if size == 0:
+            # pre_roll_frames=0, and frame[-0:] would be the whole frame
+            return
+        frame = frame[-size:]
+        end = self.pre_roll_head + len(frame)
+        if end <= size:
+            self.pre_roll[self.pre_roll_head:end] = frame
+        else:
+            split = size - self.pre_roll_head
+            self.pre_roll[self.pre_roll_head:] = frame[:split]
+            self.pre_roll[:end - size] = frame[split:]
+        self.pre_roll_head = end % size
+        self.pre_roll_count = min(self.pre_roll_count + len(frame), size)
+
+    def start(self):
+        """Begins a new utterance with the current pre-roll as its first samples."""
+        self.length = 0
+        self.truncated = False
+        if self.pre_roll_count == 0:
+            return
+        start = (self.pre_roll_head - self.pre_roll_count) % len(self.pre_roll)
+        if start + self.pre_roll_count <= len(self.pre_roll):
+            self.append(self.pre_roll[start:start + self.pre_roll_count])
+        else:
+            self.append(self.pre_roll[start:])
+            self.append(self.pre_roll[:self.pre_roll_head])
+        self.pre_roll_count = 0
+
+    def append(self, frame: np.ndarray):
+        """Writes a float32 frame and its int16 PCM copy into the segment."""
+        end = self.length + len(frame)
+        if end > self.capacity:
+            self._grow(end)
+            end = min(end, self.capacity)
+            if end - self.length < len(frame):
+                self.truncated = True
+                frame = frame[:end - self.length]
+        self.segment_f32[self.length:end] = frame
+        np.multiply(frame, 32768, out=self.segment_i16[self.length:end], casting="unsafe")
+        self.length = end
+
+    def _grow(self, needed):
+        capacity = min(max(needed, self.capacity * 2), self.max_samples)
+        if capacity <= self.capacity:
+            return
+        self.segment_f32 = np.concatenate([self.segment_f32[:self.length], np.zeros(capacity - self.length, dtype=np.float32)])
+        self.segment_i16 = np.concatenate([self.segment_i16[:self.length], np.zeros(capacity - self.length, dtype=np.int16)])
+
+    def float32(self) -> np.ndarray:
+        """Normalized float32 view of the utterance, valid until the next start()."""
+        return self.segment_f32[:self.length]
+
+    def pcm16(self) -> np.ndarray:
+        """Int16 PCM view of the utterance, valid until the next start()."""
+        return self.segment_i16[:self.length]
+
+    def snapshot(self, start=0) -> tuple[np.ndarray, np.ndarray]:
+        """Copies the utterance from sample `start` out as (float32, int16 PCM) so the buffer can be reused right away."""
+        return self.float32()[start:].copy(), self.pcm16()[start:].copy()
+
+    def clear(self):
+        self.length = 0
+        self.truncated = False
@@ -0,0 +1,139 @@
+from collections import deque
+from threading import Condition, Thread
+from typing import Any, Callable, Literal
+
+DropPolicy = Literal["block", "drop_oldest", "drop_newest"]
+
+class UtteranceWorkerPool:
+    """Bounded pool of worker threads that handles utterances off the audio capture thread.
+
+    Each utterance goes through `process` (ASR and action selection) on any free worker,
+    possibly in parallel with other utterances, then through `commit` (action execution)
+    strictly in the order the utterances were submitted.
+
+    When `max_pending` utterances are already waiting, `drop_policy` decides what happens:
+    - "block": submit() waits for a free slot, which back-pressures audio capture.
+    - "drop_oldest": the oldest waiting utterance is discarded to make room.
+    - "drop_newest": the new utterance is discarded.
+    """
+    def __init__(self, process: Callable[[Any], Any], commit: Callable[[Any], None], num_workers=1, max_pending=4, drop_policy: DropPolicy = "drop_oldest"):
+        if drop_policy not in ("block", "drop_oldest", "drop_newest"):
+            raise ValueError(f"Unknown drop_policy: {drop_policy}")
+        self.process = process
+        self.commit = commit
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+
+        self.cond = Condition()
+        self.pending = deque()   # (sequence number, item)
+        self.skipped = set()     # Sequence numbers dropped before being processed
+        self.next_seq = 0
+        self.next_commit = 0
+        self.is_running = False
+        self.workers = []
+
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self.is_running = True
+        self.workers = [Thread(target=self._worker, daemon=True) for _ in range(self.num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, wait=True):
+        """Stops the workers, waiting for already queued utterances if `wait` is True."""
+        with self.cond:
+            if not wait:
+                for seq, _ in self.pending:
+                    self._skip(seq)
+                self.pending.clear()
+            self.is_running = False
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, item) -> bool:
+        """Queues an utterance, returns False if it was dropped by the drop policy."""
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                if self.drop_policy == "block":
+                    self.cond.wait_for(lambda: len(self.pending) < self.max_pending or not self.is_running)
+                elif self.drop_policy == "drop_oldest":
+                    seq, _ = self.pending.popleft()
+                    self._skip(seq)
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+            self.pending.append((self.next_seq, item))
+            self.next_seq += 1
+            self.submitted += 1
+            self.cond.notify_all()
+            return True
+
+    def is_idle(self) -> bool:
+        """True when every submitted utterance has been committed or dropped."""
+        with self.cond:
+            return self.next_commit == self.next_seq
+
+    def queue_depth(self) -> int:
+        with self.cond:
+            return len(self.pending)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+                "pending": len(self.pending),
+            }
+
+    def _skip(self, seq):
+        """Marks a sequence number as dropped so later commits do not wait for it."""
+        self.skipped.add(seq)
+        self._advance()
+
+    def _advance(self):
+        while self.next_commit in self.skipped:
+            self.skipped.remove(self.next_commit)
+            self.next_commit += 1
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.is_running)
+                if not self.pending:
+                    return
+                seq, item = self.pending.popleft()
+                self.cond.notify_all()
+
+            try:
+                result = self.process(item)
+                ok = True
+            except Exception as error:
+                print(f"Utterance processing failed: {error}")
+                result, ok = None, False
+
+            with self.cond:
+                # Keep per-utterance order: only the oldest in-flight utterance may commit
+                self.cond.wait_for(lambda: self.next_commit == seq)
+            try:
+                if ok:
+                    self.commit(result)
+            except Exception as error:
+                print(f"Utterance commit failed: {error}")
+                ok = False
+            with self.cond:
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.next_commit += 1
+                self._advance()
+                self.cond.notify_all()
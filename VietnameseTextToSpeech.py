@@ -1,12 +1,50 @@
+import hashlib
+import os
+import wave
 import pyttsx3
-from threading import Thread
-from time import sleep
+from itertools import count
+from queue import Empty, PriorityQueue
+from threading import Event, Thread
+from time import sleep, time
+
+from ModelLoader import CACHE_DIR
 
 class VietnameseTextToSpeech:
-    def __init__(self):
-        self.engine = pyttsx3.init()
-        self.voice_id = self._find_vietnamese_voice()
-    
+    """Speaks replies on a dedicated worker thread so callers never wait for playback.
+
+    Utterances are queued by priority (lower first, FIFO within a priority). `cancel()`
+    interrupts the current utterance at the next word and drops the queued ones, which
+    is how barge-in stops a reply when the user starts talking. `is_speaking` stays
+    True for `echo_tail` seconds after playback so the VAD can ignore our own voice.
+
+    Fixed phrases spoken with `cache=True` are rendered to a WAV file once, keyed by
+    voice, rate and text under `<cache_dir>/tts/`, and afterwards played straight from
+    memory, so they cost only their playback time.
+    """
+    def __init__(self, echo_tail=0.3, cache_dir=None, playback_chunk_seconds=0.05):
+        self.echo_tail = echo_tail
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "tts")
+        self.playback_chunk_seconds = playback_chunk_seconds
+        self.rendered = {}    # text -> (pcm bytes, sample rate, channels, sample width)
+        self.queue = PriorityQueue()
+        self.order = count()
+        self.generation = 0   # Bumped by cancel(), older utterances are skipped or stopped
+        self.playing_generation = 0
+        self.rendering = False   # A phrase is being rendered to a file, which must not be cut short
+        self.ready = Event()
+        self.init_error = None   # Raised from __init__ when the engine could not be started
+        self.speaking = False
+        self.muted_until = 0.0
+        self.voice_id = None
+        self.audio = None
+        self.output_streams = {}   # (sample rate, channels, sample width) -> PyAudio stream
+        # pyttsx3 engines must be driven from the thread that created them
+        self.worker = Thread(target=self._run, name="tts", daemon=True)
+        self.worker.start()
+        self.ready.wait()
+        if self.init_error is not None:
+            raise self.init_error
+
     def _find_vietnamese_voice(self):
         voices = self.engine.getProperty('voices')
         for voice in voices:
@@ -14,15 +52,159 @@ class VietnameseTextToSpeech:
                 return voice.id
         print("Vietnamese voice not found. Please install a Vietnamese voice pack for your OS.")
         return None
-    
-    def speak(self, text):
+
+    @property
+    def is_speaking(self) -> bool:
+        return self.speaking or time() < self.muted_until
+
+    def speak(self, text, priority=1, cache=False):
+        """Queues the text and returns immediately. Pass cache=True for phrases that repeat."""
         if self.voice_id:
-            self.engine.setProperty('voice', self.voice_id)
-            self.engine.say(text)
-            self.engine.runAndWait()
+            self.queue.put((priority, next(self.order), self.generation, text, cache, True))
         else:
             print("Cannot synthesize speech without a Vietnamese voice.")
 
+    def prerender(self, texts, priority=2):
+        """Renders phrases in the background so even their first playback comes from memory."""
+        if self.voice_id:
+            for text in texts:
+                # Rendering jobs have no generation, cancel() keeps them queued
+                self.queue.put((priority, next(self.order), None, text, True, False))
+
+    def cancel(self):
+        """Stops the current utterance and drops every queued one."""
+        self.generation += 1
+        kept = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            self.queue.task_done()
+            if item[2] is None:
+                kept.append(item)
+        for item in kept:
+            self.queue.put(item)
+
+    def _on_word(self, name, location, length):
+        if self.playing_generation != self.generation and not self.rendering:
+            self.engine.stop()
+
+    def _cache_path(self, text):
+        key = hashlib.sha1(f"{self.voice_id}\n{self.engine.getProperty('rate')}\n{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".wav")
+
+    def _load_rendered(self, text):
+        """Returns the PCM of a phrase, rendering it to the disk cache first if needed."""
+        if text in self.rendered:
+            return self.rendered[text]
+        path = self._cache_path(text)
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = path + ".tmp.wav"
+            # Rendered to the end even when cancelled, a truncated file would be cached for good
+            self.rendering = True
+            try:
+                self.engine.save_to_file(text, temp_path)
+                self.engine.runAndWait()
+            finally:
+                self.rendering = False
+            if not os.path.exists(temp_path):
+                return None
+            os.replace(temp_path, path)
+        try:
+            with wave.open(path, "rb") as wav:
+                clip = (wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+        except (wave.Error, EOFError) as error:
+            # Some drivers write AIFF or other formats, these phrases are synthesized live
+            print(f"Cannot cache TTS audio for \"{text}\": {error}")
+            clip = None
+        self.rendered[text] = clip
+        return clip
+
+    def _play(self, clip, generation):
+        """Plays cached PCM in short chunks, stopping early when cancelled."""
+        pcm, sample_rate, channels, sample_width = clip
+        if self.audio is None:
+            import pyaudio
+            self.audio = pyaudio.PyAudio()
+        stream = self.output_streams.get((sample_rate, channels, sample_width))
+        if stream is None:
+            stream = self.audio.open(format=self.audio.get_format_from_width(sample_width),
+                                     channels=channels, rate=sample_rate, output=True)
+            self.output_streams[(sample_rate, channels, sample_width)] = stream
+        chunk_bytes = max(1, int(sample_rate * self.playback_chunk_seconds)) * channels * sample_width
+        for start in range(0, len(pcm), chunk_bytes):
+            if generation != self.generation:
+                break
+            stream.write(pcm[start:start + chunk_bytes])
+
+    def _run(self):
+        try:
+            self.engine = pyttsx3.init()
+            self.voice_id = self._find_vietnamese_voice()
+            if self.voice_id:
+                self.engine.setProperty('voice', self.voice_id)
+            self.engine.connect('started-word', self._on_word)
+        except Exception as error:
+            self.init_error = error
+            return
+        finally:
+            self.ready.set()
+        while True:
+            _, _, generation, text, cache, play = self.queue.get()
+            if text is None:
+                # Sentinel pushed by stop()
+                self.queue.task_done()
+                break
+            try:
+                if not play:
+                    self._load_rendered(text)
+                elif generation == self.generation:
+                    # Otherwise it was cancelled after it was taken off the queue
+                    self._speak_now(text, generation, cache)
+            except Exception as error:
+                # One bad utterance must not take the worker, and every later reply, down with it
+                print(f"Cannot speak \"{text}\": {error}")
+            finally:
+                self.queue.task_done()
+        for stream in self.output_streams.values():
+            stream.close()
+        if self.audio is not None:
+            self.audio.terminate()
+
+    def _speak_now(self, text, generation, cache):
+        self.playing_generation = generation
+        try:
+            clip = self._load_rendered(text) if cache else None
+            self.speaking = True
+            if clip is not None:
+                self._play(clip, generation)
+            else:
+                self.engine.say(text)
+                self.engine.runAndWait()
+        finally:
+            self.muted_until = time() + self.echo_tail
+            self.speaking = False
+
+    def wait(self, timeout=None):
+        """Blocks until the queue is empty and nothing is playing."""
+        deadline = None if timeout is None else time() + timeout
+        while self.queue.unfinished_tasks and (deadline is None or time() < deadline):
+            sleep(0.05)
+
+    def stop(self):
+        """Cancels playback and stops the worker thread."""
+        self.cancel()
+        self.queue.put((float("-inf"), next(self.order), self.generation, None, False, True))
+        self.worker.join()
+
 if __name__ == "__main__":
     tts = VietnameseTextToSpeech()
-    tts.speak("Xin chào! Đây là một đoạn văn bản được chuyển thành giọng nói Tiếng Việt.")
+    text = "Xin chào! Đây là một đoạn văn bản được chuyển thành giọng nói Tiếng Việt."
+    for cache in (False, True, True):
+        start_time = time()
+        tts.speak(text, cache=cache)
+        tts.wait()
+        print(f"cache={cache}: {time() - start_time:.2f} s")
+    tts.stop()
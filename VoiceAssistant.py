@@ -1,20 +1,27 @@
-import torch
-import torchaudio
 import numpy as np
-import pyaudio
-from queue import Queue
+from queue import Queue, Empty
 from time import time
-try:
-    from transformers import pipeline
-except ImportError:
-    print("Transformers is not installed. Please set use_local_ASR=False to use Google ASR instead.")
 
 from typing import Literal
 import requests
+from LLMClient import OllamaClient, SelectorFallback, enum_format, enum_list_format, collapse_repeats, get_client, parse_enum_list_response, parse_enum_response, parse_free_list_response
 from dataclasses import dataclass
 import random
 from typing import Callable
-import speech_recognition as sr
+from KeywordMatcher import KeywordMatcher
+from ModelLoader import StartupTimer, load_silero_vad, load_phowhisper
+from UtteranceBuffer import UtteranceBuffer
+from UtteranceWorkerPool import UtteranceWorkerPool
+from StreamingTranscriber import StreamingTranscriber
+from threading import Lock, RLock
+from KeywordSpotter import KeywordSpotter
+from ActionCache import CachedActionSelector
+from AudioSource import AudioSource, MicrophoneSource
+from Metrics import NULL_METRICS, Metrics
+from Endpointer import AdaptiveEndpointer, FixedEndpointer
+from EnergyGate import EnergyGate
+from WakeWord import WakeWordDetector
+from ActionExecutor import ActionExecutor
 
 @dataclass
 class Action:
@@ -23,16 +30,32 @@ class Action:
     vietnamese_description: str
     keyword: str
     func: Callable
+    device: str | None = None   # Actions of the same device run in order, None shares one lane
 
     def __str__(self):
         return f"Action: {self.name}, Description: {self.description}, Vietnamese Description: {self.vietnamese_description}, Keyword: {self.keyword}"
 
 class LLMActionSelector:
-    def __init__(self, actions: list[Action], model="qwen2.5", api_url="http://localhost:11434/api/generate", debug=False):
+    def __init__(self, actions: list[Action], model="qwen2.5", api_url="http://localhost:11434/api/generate", debug=False, client: OllamaClient | None = None, use_fallback=True,
+                 reuse_context=False, keep_alive="30m", constrained=False):
         self.debug = debug
         self.model = model
         self.api_url = api_url
         self.actions = actions
+        self.client = client or get_client()
+        self.fallback = SelectorFallback(WordsMatchingActionSelector(actions), enabled=use_fallback)
+        # Decode exactly one of the action names as JSON, with num_predict capped to fit it
+        self.constrained = constrained
+        # Prime the few-shot prefix once and only send the command afterwards
+        self.reuse_context = reuse_context
+        self.keep_alive = keep_alive
+        self.context = None
+        self.context_lock = Lock()
+        self.prime_lock = RLock()   # Held while priming, so concurrent first commands prime only once
+        self.stats_lock = Lock()
+        self.prompt_eval_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.prompt_eval_calls = 0
         
         self.base_prompt_template = (
 """You are an AI model tasked with classifying user's command into one of the following actions:  
@@ -52,10 +75,17 @@ User's command -> Desired output:
 """
         )
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
+        self.list_format, self.list_num_predict = enum_list_format([action.name for action in self.actions])
         
     def update_actions(self, new_actions: list[Action]):
         self.actions = new_actions
+        self.fallback.update_actions(new_actions)
         self.prompt = self._generate_prompt()
+        self.answer_format, self.num_predict = enum_format([action.name for action in self.actions] + ["unknown"])
+        self.list_format, self.list_num_predict = enum_list_format([action.name for action in self.actions])
+        with self.context_lock:
+            self.context = None   # Re-primed with the new prompt on the next command
     
     def _generate_prompt(self):
         action_list = "\n".join(f'- "{action.name}": {action.description}' for action in self.actions)
@@ -68,47 +98,149 @@ User's command -> Desired output:
         examples += '\n"hôm nay thời tiết thế nào?" -> "unknown"' 
         return self.base_prompt_template.format(action_list=action_list, examples=examples)
     
-    def generate_action(self, user_command: str) -> Action | str:
-        prompt = f'User\'s command: "{user_command.lower()}"\nDesired output: '
+    def _record_prompt_eval(self, result: dict):
+        tokens = result.get("prompt_eval_count", 0)
+        seconds = result.get("prompt_eval_duration", 0) / 1e9
+        with self.stats_lock:
+            self.prompt_eval_tokens += tokens
+            self.prompt_eval_seconds += seconds
+            self.prompt_eval_calls += 1
+        if self.debug:
+            print(f"[DEBUG] prompt eval: {tokens} tokens in {seconds * 1000:.1f} ms")
+
+    def prompt_eval_stats(self) -> dict:
+        """Average prompt tokens the LLM evaluated, and the time it took, per command."""
+        with self.stats_lock:
+            calls = max(self.prompt_eval_calls, 1)
+            return {"calls": self.prompt_eval_calls,
+                    "tokens_per_call": self.prompt_eval_tokens / calls,
+                    "ms_per_call": self.prompt_eval_seconds / calls * 1000}
+
+    def prime(self):
+        """Evaluates the fixed few-shot prefix once and keeps the returned context.
+
+        The request is not raw, so the prefix goes through the model's chat template and every
+        command is sent as the next user turn. Unlike without reuse_context, the few-shot prompt is
+        a user turn rather than the system prompt; the "(context)" rows of the ActionSelector
+        benchmark measure what that costs in accuracy.
+        """
+        with self.prime_lock:
+            data = {
+                "model": self.model,
+                "prompt": self.prompt,
+                "stream": False,
+                "keep_alive": self.keep_alive,
+                "options": {"temperature": 0.0, "num_predict": 1}
+            }
+            result = self.client.post(self.api_url, data)
+            context = result.get("context")
+            if context:
+                # Drop the token generated while priming, only the prefix is reused
+                context = context[:len(context) - result.get("eval_count", 0)]
+            with self.context_lock:
+                self.context = context or []
         if self.debug:
-            print("[DEBUG] prompt: " + prompt)
+            print(f"[DEBUG] primed {result.get('prompt_eval_count', 0)} prompt tokens")
+
+    def _primed_context(self) -> list:
+        """The context of the primed prefix, priming it first if needed."""
+        with self.context_lock:
+            context = self.context
+        if context is None:
+            with self.prime_lock:
+                # Another command may have primed it while this one waited for the lock
+                with self.context_lock:
+                    context = self.context
+                if context is None:
+                    self.prime()
+                    with self.context_lock:
+                        context = self.context
+        return context
+
+    def _complete(self, suffix: str, answer_format: dict, num_predict: int) -> str:
+        """Sends the few-shot prompt followed by `suffix` and returns the raw answer."""
         data = {
             "model": self.model,
             "system": self.prompt,
-            "prompt": prompt,
+            "prompt": suffix,
             "stream": False,
             "options": {"temperature": 0.0}
         }
+        if self.reuse_context:
+            context = self._primed_context()
+            data["keep_alive"] = self.keep_alive
+            if context:
+                # The few-shot prompt was the priming turn, otherwise the server returned no context
+                del data["system"]
+                data["context"] = context
+        if self.constrained:
+            data["format"] = answer_format
+            data["options"]["num_predict"] = num_predict
+        if self.debug:
+            print("[DEBUG] prompt: " + data["prompt"])
+        result = self.client.post(self.api_url, data)
+        self._record_prompt_eval(result)
+        text = result.get('response')
+        if self.debug:
+            print("[DEBUG] response: " + text)
+        return text
+
+    def generate_action(self, user_command: str) -> Action | str:
+        suffix = f'User\'s command: "{user_command.lower()}"\nDesired output: '
         try:
-            response = requests.post(self.api_url, json=data)
-            response.raise_for_status()
-            text = response.json().get('response')
-            if self.debug:
-                print("[DEBUG] response: " + text)
-            for action in self.actions:
-                if action.name in text:
-                    return action
-            return "unknown"
+            text = self._complete(suffix, self.answer_format, self.num_predict)
         except requests.exceptions.RequestException as error:
-            return f"Error: {error}"
+            return self.fallback.answer(user_command, error)
+        name = parse_enum_response(text, self.answer_format["enum"]) if self.constrained else None
+        for action in self.actions:
+            if action.name == name or (name is None and action.name in text):
+                return action
+        return "unknown"
+
+    def generate_actions(self, user_command: str) -> list:
+        """Every action the command calls, in the order it asks for them, from one LLM request."""
+        suffix = (f'User\'s command: "{user_command.lower()}"\n'
+                  'The command may call several actions, return all of them as a JSON list in the order they are asked, '
+                  'or an empty list if none match.\nDesired output: ')
+        try:
+            text = self._complete(suffix, self.list_format, self.list_num_predict)
+        except requests.exceptions.RequestException as error:
+            return self.fallback.answer(user_command, error, multiple=True)
+        names = parse_enum_list_response(text, self.list_format["items"]["enum"]) if self.constrained else None
+        if names is None:
+            # Free-form answer, take the action names in the order they appear
+            names = parse_free_list_response(text, [action.name for action in self.actions])
+        actions = {action.name: action for action in self.actions}
+        return [actions[name] for name in names]
         
 class WordsMatchingActionSelector:
     def __init__(self, actions: list[Action]):
-        self.actions = actions
+        self.matcher = KeywordMatcher()
+        self.update_actions(actions)
     
     def update_actions(self, new_actions: list[Action]):
         self.actions = new_actions
+        # Compile every keyword and its synonym variants into one automaton
+        self.matcher.build([(action.keyword, action) for action in self.actions])
 
     def generate_action(self, user_command: str) -> Action | Literal['unknown']:
-        user_command = user_command.lower()
-        for action in self.actions:
-            if action.keyword in user_command:
-                return action
-        return "unknown"
+        match = self.matcher.best(user_command)
+        if match is None:
+            return "unknown"
+        return match.value
+
+    def generate_actions(self, user_command: str) -> list[Action]:
+        """Every action whose keyword appears in the command, in spoken order with repeats kept, from one matcher pass."""
+        return collapse_repeats([match.value for match in self.matcher.non_overlapping(user_command)])
 
 class VoiceAssistant:
-    def __init__(self, action_lst: list[Action], use_local_llm=False, use_local_ASR=False, sample_rate=16000, chunk_size=512, speech_threshold=0.5, silence_timeout=1.0, pre_buffer_max=16):
+    def __init__(self, action_lst: list[Action], use_local_llm=False, use_local_ASR=False, sample_rate=16000, chunk_size=512, speech_threshold=0.5, silence_timeout=1.0, pre_buffer_max=16, poll_timeout=0.1, vad_batch_size=4, max_utterance_seconds=30.0, num_workers=1, max_pending_utterances=4, drop_policy="drop_oldest", streaming_asr=False, keyword_spotting=False, keyword_templates_dir=None, vad_backend="torchscript", asr_backend="pytorch", num_threads=None, action_cache_size=256, action_cache_ttl=3600.0, action_cache_path=None, llm_reuse_context=False, llm_constrained=False, adaptive_endpointing=False, energy_gate=False, wake_word=None, wake_word_dir=None, wake_word_window=8.0, audio_source: AudioSource | None = None, metrics: Metrics | None = None, action_workers=2, action_timeout=5.0, action_debounce=1.5):
         self.debug = False
+        # Timing spans and counters, NULL_METRICS records nothing
+        self.metrics = metrics or NULL_METRICS
+        # torch, transformers, pyaudio and speech_recognition are imported lazily below,
+        # so Action and the selectors in this module can be used without them
+        timer = StartupTimer()
 
         self.use_llm = use_local_llm
         self.use_local_ASR = use_local_ASR
@@ -117,134 +249,373 @@ class VoiceAssistant:
         self.speech_threshold = speech_threshold
         self.silence_timeout = silence_timeout 
         self.pre_buffer_max = pre_buffer_max 
+        self.poll_timeout = poll_timeout
 
         self.audio_queue = Queue()
         self.is_running = False
         self.recording = False
-        self.audio_buffer = []  
-        self.pre_buffer = []   
+        self.utterance = UtteranceBuffer(sample_rate, chunk_size, pre_roll_frames=pre_buffer_max, max_seconds=max_utterance_seconds)
         self.last_speech_time = 0
+        self.utterance_id = 0
+
+        with timer.phase("import torch"):
+            from BatchedVAD import BatchedVAD
 
-        # Load Silero VAD model
-        self.vad_model, utils = torch.hub.load('snakers4/silero-vad', 'silero_vad')
-        self.get_speech_timestamps = utils[0]
+        # Load Silero VAD model from the local cache
+        with timer.phase("load VAD"):
+            self.vad_model = load_silero_vad(backend=vad_backend, num_threads=num_threads)
+            # Lets clearly silent frames, e.g. hours of an empty room, skip the neural VAD
+            gate = EnergyGate(chunk_size / sample_rate) if energy_gate else None
+            self.vad = BatchedVAD(self.vad_model, self.sample_rate, self.chunk_size, batch_size=vad_batch_size, gate=gate)
         
-        if self.use_local_ASR:
-            # Load PhoWhisper ASR model
-            self.transcriber = pipeline("automatic-speech-recognition", model="vinai/PhoWhisper-medium")
-        else:
-            # Load Google ASR model
-            self.recognizer = sr.Recognizer()
+        with timer.phase("load ASR"):
+            if self.use_local_ASR:
+                # Load PhoWhisper ASR model from the local cache
+                self.transcriber = load_phowhisper(backend=asr_backend, num_threads=num_threads)
+            else:
+                # Load Google ASR model
+                import speech_recognition as sr
+                self.recognizer = sr.Recognizer()
 
         # Initialize PyAudio
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.sample_rate,
-            input=True,
-            frames_per_buffer=self.chunk_size,
-            stream_callback=self.callback
-        )
+        with timer.phase("open audio source"):
+            # The microphone by default, WAV files or synthetic audio for offline runs and benchmarks
+            self.source = audio_source or MicrophoneSource(self.sample_rate, self.chunk_size)
+            self.source.open(self.callback)
 
         # Initialize action selector
-        self.action_lst = action_lst
-        if use_local_llm:
-            self.action_selector = LLMActionSelector(self.action_lst)
+        with timer.phase("action selector"):
+            self.action_lst = action_lst
+            if use_local_llm:
+                self.action_selector = LLMActionSelector(self.action_lst, reuse_context=llm_reuse_context, constrained=llm_constrained)
+            else:
+                self.action_selector = WordsMatchingActionSelector(self.action_lst)
+            # Repeated commands skip the selector, and the LLM round-trip, entirely
+            self.action_selector = CachedActionSelector(self.action_selector, max_size=action_cache_size,
+                                                        ttl=action_cache_ttl, path=action_cache_path)
+
+        # ASR, action selection and action execution run off the capture thread
+        self.workers = UtteranceWorkerPool(self._process_utterance, self.execute_action,
+                                           num_workers=num_workers, max_pending=max_pending_utterances,
+                                           drop_policy=drop_policy)
+        self.action_lock = Lock()
+        # Device callbacks (MQTT publishes) run on their own workers so a slow broker
+        # does not hold up the next utterance
+        self.executor = ActionExecutor(num_workers=action_workers, timeout=action_timeout,
+                                       debounce_seconds=action_debounce, metrics=self.metrics)
+
+        # Decode partial hypotheses while the user is still speaking (PhoWhisper only) and
+        # run the action as soon as a keyword is stable, without waiting for the silence timeout
+        self.streaming = None
+        self.early_actions = {}  # utterance_id -> action already executed from a partial
+        self.early_lock = Lock()
+        if streaming_asr and self.use_local_ASR:
+            self.streaming = StreamingTranscriber(self.transcriber, self.sample_rate, on_partial=self._on_partial_transcription)
+            self.keyword_selector = WordsMatchingActionSelector(self.action_lst)
+
+        # Decides how much trailing silence closes an utterance, the adaptive one shortens it for
+        # clearly finished commands and lengthens it for hesitations
+        frame_seconds = chunk_size / sample_rate
+        if adaptive_endpointing:
+            self.endpointer = AdaptiveEndpointer(frame_seconds, speech_threshold, silence_timeout,
+                                                 keywords=[action.keyword for action in self.action_lst])
         else:
-            self.action_selector = WordsMatchingActionSelector(self.action_lst)
+            self.endpointer = FixedEndpointer(frame_seconds, speech_threshold, silence_timeout)
+
+        # Only utterances that contain the wake phrase, or follow it within wake_word_window
+        # seconds, are transcribed. TV audio and conversations never reach ASR or the LLM.
+        # The window restarts at each detection and each command that selected an action,
+        # so unrelated speech in it cannot keep the gate open
+        self.wake_word = None
+        self.wake_word_window = wake_word_window
+        self.listening_until = 0.0
+        self.addressed = True        # The current utterance is meant for the assistant
+        self.command_frames = None   # Speech frames after the wake phrase in the current utterance
+        self.command_start = 0       # Sample where the command starts, after a wake phrase spotted mid-utterance
+        self.min_command_frames = int(0.15 * sample_rate / chunk_size)
+        self.uses_llm = use_local_llm
+        self.skipped_utterances = 0
+        self.skipped_seconds = 0.0
+        if wake_word is not None:
+            self.wake_word = WakeWordDetector(wake_word, sample_rate)
+            if wake_word_dir is not None:
+                self.wake_word.enroll_directory(wake_word_dir)
+            if not self.wake_word.templates:
+                print(f'No recordings of "{wake_word}" found, wake word gating is disabled.')
+                self.wake_word = None
+
+        # Match short fixed commands against keyword templates before running ASR
+        self.keyword_spotter = None
+        if keyword_spotting:
+            self.keyword_spotter = KeywordSpotter(self.sample_rate)
+            if keyword_templates_dir is not None:
+                self.keyword_spotter.enroll_directory(keyword_templates_dir)
+        timer.report()
 
     def update_actions(self, new_actions: list[Action]):
         self.action_lst = new_actions
         self.action_selector.update_actions(new_actions)
+        if self.streaming is not None:
+            self.keyword_selector.update_actions(new_actions)
+        self.endpointer.set_keywords([action.keyword for action in new_actions])
+        if self.keyword_spotter is not None:
+            self.keyword_spotter.retain({action.name for action in new_actions})
 
     def callback(self, in_data, frame_count, time_info, status):
         """Reads audio stream into a queue."""
+        if status:
+            # PyAudio reports an input overflow when chunks were dropped before this callback
+            self.metrics.inc("audio_input_overflows")
         self.audio_queue.put(in_data)
-        return (in_data, pyaudio.paContinue)
+        return (in_data, self.source.continue_flag)
 
     def process_audio(self):
         """Processes audio and performs speech recognition when speech is detected."""
         while self.is_running:
-            if not self.audio_queue.empty():
-                audio_chunk = self.audio_queue.get()
-                # Convert to normalized numpy array
-                audio_np = np.frombuffer(audio_chunk, dtype=np.int16).astype(np.float32) / 32768.0
-                audio_tensor = torch.from_numpy(audio_np)
-
-                # Compute speech probability
-                speech_prob = self.vad_model(audio_tensor, self.sample_rate).item()
-
-                if speech_prob > self.speech_threshold:
-                    self.last_speech_time = time()  
-                    if not self.recording:
-                        print("Speech detected! Recording started...")
-                        self.recording = True
-                        self.audio_buffer = self.pre_buffer.copy()
-                        self.pre_buffer = [] 
-                elif (time() - self.last_speech_time) > self.silence_timeout:
-                    self.recording = False
-
-                if self.recording:
-                    self.audio_buffer.append(audio_np)
-                elif len(self.audio_buffer) >= 1:
-                    print("Silence detected! Transcribing...")
-                    self.transcribe_audio()
-                    self.audio_buffer = []
+            try:
+                # Block until the PyAudio callback delivers a chunk instead of spinning on empty()
+                audio_chunk = self.audio_queue.get(timeout=self.poll_timeout)
+            except Empty:
+                # No audio arrived in time, score what is pending and still close an
+                # utterance whose silence timeout elapsed
+                self._process_vad_batch()
+                if self.recording and (time() - self.last_speech_time) > self.endpointer.required_silence():
                     self.recording = False
+                    self._finish_utterance()
+                continue
+            if audio_chunk is None:
+                # Sentinel pushed by stop()
+                break
+
+            self.vad.push(audio_chunk)
+            if self.vad.ready():
+                self._process_vad_batch()
+
+    def _process_vad_batch(self):
+        """Runs VAD over the pending chunks and feeds each frame to the recording state machine."""
+        with self.metrics.span("vad"):
+            frames = self.vad.flush()
+        if self.metrics.enabled:
+            self.metrics.set_gauge("audio_queue_depth", self.audio_queue.qsize())
+            if self.vad.gate is not None:
+                self.metrics.set_gauge("vad_gate_skip_ratio", self.vad.gate.skip_ratio)
+        for audio_np, speech_prob in frames:
+            self._update_recording(audio_np, speech_prob)
+
+    def _update_recording(self, audio_np, speech_prob):
+        """Advances the recording state machine by one frame."""
+        if speech_prob > self.speech_threshold:
+            self.last_speech_time = time()
+            if not self.recording:
+                print("Speech detected! Recording started...")
+                self.recording = True
+                self.utterance.start()
+                self.utterance_id += 1
+                self.endpointer.start()
+                self.addressed = self.wake_word is None or time() < self.listening_until
+                self.command_frames = None
+                self.command_start = 0
+                if self.wake_word is not None:
+                    # The VAD triggers a little late, the phrase may start in the pre-roll
+                    self.wake_word.reset(self.utterance.float32())
+                if self.streaming is not None and self.addressed:
+                    self.streaming.begin_utterance(self.utterance_id)
+            elif self.command_frames is not None:
+                self.command_frames += 1
+        if self.recording and self.endpointer.update(speech_prob):
+            self.recording = False
+
+        if self.recording:
+            self.utterance.append(audio_np)
+            if not self.addressed and self.wake_word.feed(audio_np):
+                self._on_wake_word()
+            if self.streaming is not None:
+                self.streaming.feed(self.utterance_id, self.utterance.float32()[self.command_start:])
+        elif len(self.utterance) >= 1:
+            self._finish_utterance()
+
+        if not self.recording:
+            self.utterance.push_pre_roll(audio_np)
+
+    def _on_wake_word(self):
+        print("Wake word detected, listening...")
+        self.metrics.inc("wake_word_detections")
+        self.addressed = True
+        self.command_frames = 0
+        # The phrase ends at the newest sample, only what follows is the command
+        self.command_start = len(self.utterance)
+        self.listening_until = time() + self.wake_word_window
+        if self.streaming is not None:
+            self.streaming.begin_utterance(self.utterance_id)
+
+    def _skip_utterance(self, reason: str):
+        """Drops an utterance that was not meant for the assistant before any ASR or LLM work."""
+        print(f"{reason}, skipping {self.utterance.duration:.2f} s without transcription.")
+        self.skipped_utterances += 1
+        self.skipped_seconds += self.utterance.duration
+        if self.streaming is not None:
+            self.streaming.end_utterance(self.utterance_id)
+        self.metrics.inc("asr_calls_avoided")
+        self.metrics.inc("asr_seconds_avoided", self.utterance.duration)
+        if self.uses_llm:
+            self.metrics.inc("llm_calls_avoided")
+        self.utterance.clear()
+        self.recording = False
 
-                if not self.recording:
-                    self.pre_buffer.append(audio_np)
-                    if len(self.pre_buffer) > self.pre_buffer_max:
-                        self.pre_buffer.pop(0)
+    def _finish_utterance(self):
+        """Hands the buffered utterance to the worker pool and resets the recording state."""
+        if self.wake_word is not None:
+            if not self.addressed:
+                self._skip_utterance("Not addressed to the assistant")
+                return
+            if self.command_frames is not None and self.command_frames < self.min_command_frames:
+                # Only the wake phrase was said, the command follows in the listening window
+                self._skip_utterance("Wake word only")
+                return
+        # Time from the last speech frame until the utterance was closed (VAD hangover)
+        self.metrics.observe("endpoint_delay", time() - self.last_speech_time)
+        self.metrics.inc(f"endpoints_{self.endpointer.reason}")
+        print(f"Silence detected! Queueing {self.utterance.duration:.2f} s for transcription "
+              f"({self.utterance.nbytes / 1024:.0f} KB buffered{', truncated' if self.utterance.truncated else ''})...")
+        if self.streaming is not None:
+            with self.early_lock:
+                self.streaming.end_utterance(self.utterance_id)
+        if not self.workers.submit((self.utterance_id, *self.utterance.snapshot(self.command_start))):
+            print("Transcription queue is full, utterance dropped.")
+            self.metrics.inc("utterances_dropped")
+        if self.metrics.enabled:
+            self.metrics.set_gauge("utterance_queue_depth", self.workers.queue_depth())
+        self.utterance.clear()
+        self.recording = False
 
-    def transcribe_audio(self):
-        """Concatenates buffered audio segments and transcribes using PhoWhisper."""
-        if not self.audio_buffer:
-            return
+    def _process_utterance(self, audio):
+        with self.metrics.span("transcribe_audio"):
+            return self.transcribe_audio(audio)
 
-        full_audio = np.concatenate(self.audio_buffer)
+    def transcribe_audio(self, audio):
+        """Transcribes one utterance using PhoWhisper or Google ASR and selects its action. Runs on a worker thread."""
+        utterance_id, full_audio, pcm16 = audio
         
         # Save to a file if debugging is enabled
         if self.debug:
+            import torch
+            import torchaudio
             audio_tensor = torch.from_numpy(full_audio)
             torchaudio.save("temp.wav", audio_tensor.unsqueeze(0), self.sample_rate)
 
+        if self.keyword_spotter is not None:
+            with self.metrics.span("keyword_spotting"):
+                action_name = self.keyword_spotter.spot(full_audio)
+            action = next((action for action in self.action_lst if action.name == action_name), None)
+            if action is not None:
+                print("Keyword spotted:", action.name)
+                return None if self._take_early_action(utterance_id) is not None else action
+
         if self.use_local_ASR:
-            result = self.transcriber(full_audio)['text']
+            with self.metrics.span("asr"):
+                result = self.transcriber(full_audio)['text']
         else:
-            pcm16 = (full_audio * 32768).astype(np.int16)
+            import speech_recognition as sr
             byte_data = pcm16.tobytes()
             audio_data = sr.AudioData(byte_data,
                                     sample_rate=self.sample_rate,
                                     sample_width=2) 
             try:
-                result = self.recognizer.recognize_google(audio_data, language="vi-VN")
+                with self.metrics.span("asr"):
+                    result = self.recognizer.recognize_google(audio_data, language="vi-VN")
             except:
                 print("Could not understand audio")
                 result = "unknown"
         print("Transcription:", result)
-
-        # Generate action
-        action = self.action_selector.generate_action(result)
+        if self.wake_word is not None:
+            result = self.wake_word.strip(result)
+
+        early_action = self._take_early_action(utterance_id)
+
+        # Generate every action of the command, e.g. "tắt đèn và bật quạt", in one selector call
+        with self.metrics.span("action_selection"):
+            actions = self.action_selector.generate_actions(result)
+        if self.keyword_spotter is not None and isinstance(actions, list) and len(actions) == 1:
+            # Learn a keyword template from utterances ASR understood, only when they say the keyword itself
+            if actions[0].keyword and actions[0].keyword in result.lower():
+                self.keyword_spotter.learn(actions[0].name, full_audio)
+        if early_action is not None:
+            # Only the actions after the early one are still to run
+            # "bật đèn rồi tắt đèn rồi bật đèn" still has to turn the light on again at the end
+            remaining = list(actions) if isinstance(actions, list) else []
+            if early_action in remaining:
+                remaining.remove(early_action)
+            return remaining or None
+        return actions
+
+    def _take_early_action(self, utterance_id):
+        """The action of this utterance that already ran from a stable partial hypothesis, if any."""
+        with self.early_lock:
+            return self.early_actions.pop(utterance_id, None)
+
+    def _on_partial_transcription(self, utterance_id, text, stable_text):
+        """Executes the action as soon as a stable partial hypothesis contains its keyword."""
+        print("Partial transcription:", text)
+        if utterance_id == self.utterance_id:
+            self.endpointer.on_partial(text)
+        action = self.keyword_selector.generate_action(stable_text)
         if isinstance(action, str):
-            print("Action: Unknown")
-        else:
-            print("Action: ", action.name)
-            action.func()
+            return
+        with self.early_lock:
+            if not self.streaming.is_active(utterance_id) or utterance_id in self.early_actions:
+                return
+            if not self.workers.is_idle():
+                # An earlier utterance has not run its actions yet, this one must not overtake it
+                return
+            self.early_actions[utterance_id] = action
+            # Dispatched before the utterance can be submitted, so its remaining actions follow this one
+            print("Keyword is stable, executing before end of speech...")
+            self.execute_action(action)
+
+    def execute_action(self, action: Action | list[Action] | str | None):
+        """Dispatches the selected actions to the executor in spoken order. Called in utterance order.
+
+        Actions of different devices then run concurrently, those of one device in order.
+        """
+        if action is None:
+            return
+        actions = [action] if isinstance(action, Action) else action
+        with self.action_lock:
+            if isinstance(actions, str) or not actions:
+                print("Action: Unknown")
+                return
+            for action in actions:
+                print("Action: ", action.name)
+                if not self.executor.submit(action):
+                    print("Repeated command, coalesced with the previous one.")
+            if self.wake_word is not None:
+                self.listening_until = time() + self.wake_word_window
 
     def start(self):
-        """Starts the microphone stream."""
+        """Starts the audio source."""
         self.is_running = True
-        self.stream.start_stream()
+        self.executor.start()
+        self.workers.start()
+        if self.streaming is not None:
+            self.streaming.start()
+        self.source.start()
         print("Speech Recognition started...")
 
     def stop(self):
-        """Stops the microphone stream."""
+        """Stops the audio source."""
         self.is_running = False
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        # Wake up process_audio if it is blocked on an empty queue
+        self.audio_queue.put(None)
+        self.source.stop()
+        self.source.close()
+        self.workers.stop()
+        if self.streaming is not None:
+            self.streaming.stop()
+        self.action_selector.close()
+        self.executor.stop()
+        if self.wake_word is not None:
+            print(f"Wake word: {self.wake_word.detections} detections, {self.skipped_utterances} utterances "
+                  f"({self.skipped_seconds:.1f} s) skipped without ASR{' or LLM' if self.uses_llm else ''}.")
         print("Speech Recognition stopped.")
 
 if __name__ == "__main__":
@@ -304,10 +675,10 @@ if __name__ == "__main__":
         return Action(name, description, vietnamese_description, keyword, action_func)
 
     action_lst = [
-        Action("turn_on_light", "Turn on the light", "bật đèn", "bật đèn", turn_on_light),
-        Action("turn_off_light", "Turn off the light", "tắt đèn", "tắt đèn", turn_off_light),
-        Action("turn_on_fan", "Turn on the fan", "bật quạt", "bật quạt", turn_on_fan),
-        Action("turn_off_fan", "Turn off the fan", "tắt quạt", "tắt quạt", turn_off_fan),
+        Action("turn_on_light", "Turn on the light", "bật đèn", "bật đèn", turn_on_light, device="BBC-LED"),
+        Action("turn_off_light", "Turn off the light", "tắt đèn", "tắt đèn", turn_off_light, device="BBC-LED"),
+        Action("turn_on_fan", "Turn on the fan", "bật quạt", "bật quạt", turn_on_fan, device="BBC-FAN"),
+        Action("turn_off_fan", "Turn off the fan", "tắt quạt", "tắt quạt", turn_off_fan, device="BBC-FAN"),
     ]
     
     voice_assistant = VoiceAssistant(action_lst, use_local_llm=False, use_local_ASR=False)
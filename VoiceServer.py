@@ -0,0 +1,412 @@
+import heapq
+import socketserver
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import perf_counter, time
+
+import numpy as np
+
+from ActionCache import CachedActionSelector
+from ActionSelector import Action, WordsMatchingActionSelector
+from AudioSource import AudioSource
+from EnergyGate import EnergyGate, frame_features
+from Metrics import NULL_METRICS, Metrics
+from ModelLoader import StartupTimer, load_phowhisper, load_silero_vad
+from UtteranceBuffer import UtteranceBuffer
+
+def _resized(array, rows: int, axis: int):
+    """A NumPy array or torch tensor cut or zero-padded to `rows` along `axis`."""
+    kept = array[:rows] if axis == 0 else array[:, :rows]
+    shape = list(kept.shape)
+    shape[axis] = rows - shape[axis]
+    if isinstance(array, np.ndarray):
+        return np.ascontiguousarray(np.concatenate([kept, np.zeros(shape, dtype=array.dtype)], axis=axis))
+    import torch
+    return torch.cat([kept, torch.zeros(shape, dtype=array.dtype)], dim=axis).contiguous()
+
+class AudioStream:
+    """Recording state of one microphone or network client served by a VoiceServer."""
+    def __init__(self, stream_id, on_action, sample_rate, chunk_size, pre_roll_frames, max_utterance_seconds, gate: EnergyGate | None = None, slot=0):
+        self.stream_id = stream_id
+        self.slot = slot             # Row of the VAD batch, and of the model's recurrent state
+        self.on_action = on_action   # Called with (stream_id, action, transcription)
+        self.chunk_size = chunk_size
+        self.frames = deque()        # float32 frames waiting for VAD
+        self.residual = np.zeros(0, dtype=np.int16)
+        self.utterance = UtteranceBuffer(sample_rate, chunk_size, pre_roll_frames=pre_roll_frames, max_seconds=max_utterance_seconds)
+        self.recording = False
+        self.silence_frames = 0
+        self.utterance_id = 0
+        self.source = None
+        self.gate = gate             # Noise floor of this stream when the server gates the VAD
+
+    def push(self, data: bytes):
+        """Splits int16 PCM of any length into VAD frames."""
+        pcm16 = np.concatenate([self.residual, np.frombuffer(data, dtype=np.int16)])
+        n_frames = len(pcm16) // self.chunk_size
+        for i in range(n_frames):
+            self.frames.append(pcm16[i * self.chunk_size:(i + 1) * self.chunk_size].astype(np.float32) / 32768.0)
+        self.residual = pcm16[n_frames * self.chunk_size:]
+
+    def update(self, frame: np.ndarray, speech_prob: float, speech_threshold: float, silence_timeout_frames: float):
+        """Advances the recording state machine by one frame, returns a finished utterance or None."""
+        if speech_prob > speech_threshold:
+            self.silence_frames = 0
+            if not self.recording:
+                self.recording = True
+                self.utterance.start()
+                self.utterance_id += 1
+        elif self.recording:
+            self.silence_frames += 1
+            if self.silence_frames > silence_timeout_frames:
+                self.recording = False
+
+        finished = None
+        if self.recording:
+            self.utterance.append(frame)
+        elif len(self.utterance) >= 1:
+            finished = (self.stream_id, self.utterance_id, self.utterance.float32().copy())
+            self.utterance.clear()
+        if not self.recording:
+            self.utterance.push_pre_roll(frame)
+        return finished
+
+class VoiceServer:
+    """Serves many audio streams from one process with one VAD model and one ASR model.
+
+    Every stream keeps its own recording state. VAD runs in lockstep: each call scores one
+    frame of every stream as one batch, so the model keeps one recurrent state per row.
+    Each stream owns a row for as long as it is connected and takes the lowest free one, and
+    only the rows up to the highest occupied one are scored, so one stream costs one row
+    rather than `max_streams`. When that changes the batch size, the kept rows carry their
+    states over (the model alone would reset every state) and added rows start fresh; a
+    row's state is also cleared when a new stream takes it over. Free rows below the highest
+    occupied one, and streams that have no frame within `max_lag` seconds, are padded with
+    silence for that step.
+    With `energy_gate`, a step in which every stream's frame is clearly silent skips the
+    model call, so idle streams cost only the NumPy gate.
+    Finished utterances of all streams are transcribed together, up to `asr_batch_size` per
+    PhoWhisper call, and each stream's callback receives its actions in utterance order.
+    """
+    def __init__(self, actions: list[Action], action_selector=None, sample_rate=16000, chunk_size=512,
+                 speech_threshold=0.5, silence_timeout=1.0, pre_buffer_max=16, max_utterance_seconds=30.0,
+                 max_streams=16, max_lag=0.1, asr_batch_size=8, asr_batch_wait=0.05, max_pending_utterances=64,
+                 vad_backend="torchscript", asr_backend="pytorch", num_threads=None,
+                 action_cache_size=256, energy_gate=False, metrics: Metrics | None = None):
+        self.metrics = metrics or NULL_METRICS
+        timer = StartupTimer()
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.speech_threshold = speech_threshold
+        self.silence_timeout_frames = silence_timeout * sample_rate / chunk_size
+        self.pre_buffer_max = pre_buffer_max
+        self.max_utterance_seconds = max_utterance_seconds
+        self.max_streams = max_streams
+        self.max_lag = max_lag
+        self.asr_batch_size = asr_batch_size
+        self.asr_batch_wait = asr_batch_wait
+        self.max_pending_utterances = max_pending_utterances
+        self.energy_gate = energy_gate
+
+        with timer.phase("import torch"):
+            import torch
+            self.torch = torch
+        with timer.phase("load VAD"):
+            self.vad_model = load_silero_vad(backend=vad_backend, num_threads=num_threads)
+        with timer.phase("load ASR"):
+            self.transcriber = load_phowhisper(backend=asr_backend, num_threads=num_threads)
+        with timer.phase("action selector"):
+            self.action_selector = CachedActionSelector(action_selector or WordsMatchingActionSelector(actions), max_size=action_cache_size)
+        timer.report()
+
+        self.streams: dict[str, AudioStream] = {}
+        self.free_slots = list(range(max_streams))   # Heap, so new streams take the lowest free row
+        self.vad_rows = 0           # Batch size the model's recurrent state currently has
+        self.stale_slots = set()    # Rows whose recurrent state belongs to a removed stream
+        self.audio_cond = Condition()
+        self.utterances = deque()   # (stream_id, utterance_id, float32 audio)
+        self.utterance_cond = Condition()
+        self.is_running = False
+        self.threads = []
+        self.tcp_server = None
+        self.dropped = 0
+        self.transcribed = 0
+        self.vad_steps = 0
+        self.vad_steps_skipped = 0
+
+    def add_stream(self, stream_id, on_action, source: AudioSource | None = None):
+        """Registers a stream. With a source, its audio is read from it, otherwise call feed().
+
+        Raises RuntimeError when `max_streams` streams are already connected.
+        """
+        gate = EnergyGate(self.chunk_size / self.sample_rate) if self.energy_gate else None
+        with self.audio_cond:
+            if not self.free_slots:
+                raise RuntimeError(f"Voice server is full ({self.max_streams} streams)")
+            stream = AudioStream(stream_id, on_action, self.sample_rate, self.chunk_size, self.pre_buffer_max,
+                                 self.max_utterance_seconds, gate, slot=heapq.heappop(self.free_slots))
+            self.streams[stream_id] = stream
+        if source is not None:
+            stream.source = source
+            source.open(lambda in_data, frame_count, time_info, status: (self.feed(stream_id, in_data), (in_data, source.continue_flag))[1])
+            if self.is_running:
+                source.start()
+        return stream
+
+    def remove_stream(self, stream_id):
+        with self.audio_cond:
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                heapq.heappush(self.free_slots, stream.slot)
+                self.stale_slots.add(stream.slot)
+        if stream is not None and stream.source is not None:
+            stream.source.stop()
+            stream.source.close()
+
+    def feed(self, stream_id, data: bytes):
+        """Queues int16 PCM of a stream, safe to call from audio callbacks and socket threads."""
+        with self.audio_cond:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                stream.push(data)
+                self.audio_cond.notify()
+
+    def _next_vad_batch(self):
+        """Waits until every stream has a frame, or max_lag passed with at least one frame pending."""
+        with self.audio_cond:
+            deadline = None
+            while self.is_running:
+                streams = list(self.streams.values())
+                waiting = sum(1 for stream in streams if stream.frames)
+                if streams and waiting == len(streams):
+                    break
+                if waiting:
+                    deadline = deadline or perf_counter() + self.max_lag
+                    if perf_counter() >= deadline:
+                        break
+                self.audio_cond.wait(timeout=self.max_lag if deadline is None else max(deadline - perf_counter(), 0))
+            else:
+                return [], None
+            frames = [stream.frames.popleft() if stream.frames else None for stream in streams]
+            stale_slots, self.stale_slots = self.stale_slots, set()
+        if stale_slots:
+            self._reset_slots(stale_slots)
+        rows = max(stream.slot for stream in streams) + 1 if self._vad_state_names()[0] else self.max_streams
+        batch = np.zeros((rows, self.chunk_size), dtype=np.float32)
+        for stream, frame in zip(streams, frames):
+            if frame is not None:
+                batch[stream.slot] = frame
+        return list(zip(streams, frames)), batch
+
+    def _vad_state_names(self):
+        """Attributes holding the model's recurrent state and context, (None, None) if it has none."""
+        # TorchScript Silero keeps them in _state/_context, OnnxSileroVAD in state/context
+        for names in (("_state", "_context"), ("state", "context")):
+            if getattr(self.vad_model, names[0], None) is not None:
+                return names
+        return None, None
+
+    def _reset_slots(self, slots):
+        """Clears the recurrent state and context that removed streams left in their batch rows."""
+        state_name, context_name = self._vad_state_names()
+        if state_name is None:
+            return
+        state = getattr(self.vad_model, state_name)
+        context = getattr(self.vad_model, context_name, None)
+        # Rows above the current batch are not in the model, they start fresh when the batch grows
+        slots = sorted(slot for slot in slots if slot < self.vad_rows)
+        if not slots:
+            return
+        with self.torch.inference_mode():
+            if state.ndim == 3 and state.shape[1] == self.vad_rows:
+                state[:, slots] = 0
+            if context is not None and context.ndim == 2 and context.shape[0] == self.vad_rows:
+                context[slots] = 0
+
+    def _resize_vad_state(self, rows: int):
+        """Gives the model's recurrent state `rows` rows, keeping the states of the rows that stay."""
+        if rows == self.vad_rows:
+            return
+        state_name, context_name = self._vad_state_names()
+        if self.vad_rows and state_name is not None:
+            # The first call sizes the state itself
+            with self.torch.inference_mode():
+                setattr(self.vad_model, state_name, _resized(getattr(self.vad_model, state_name), rows, axis=1))
+                context = getattr(self.vad_model, context_name, None)
+                if context is not None and len(context):
+                    setattr(self.vad_model, context_name, _resized(context, rows, axis=0))
+                if hasattr(self.vad_model, "_last_batch_size"):
+                    # Otherwise the TorchScript model resets every state on the new batch size
+                    self.vad_model._last_batch_size = rows
+        self.vad_rows = rows
+
+    def _vad_loop(self):
+        while self.is_running:
+            rows, batch = self._next_vad_batch()
+            if batch is None:
+                continue
+            self.vad_steps += 1
+            admitted = None
+            if self.energy_gate:
+                level_db, flatness = frame_features(batch[[stream.slot for stream, _ in rows]])
+                admitted = [frame is not None and stream.gate.admit(level, flat)
+                            for (stream, frame), level, flat in zip(rows, level_db.tolist(), flatness.tolist())]
+            if admitted is not None and not any(admitted):
+                # Every stream is silent, the recurrent states keep their last speech context
+                self.vad_steps_skipped += 1
+                self.metrics.inc("vad_steps_skipped")
+                probs = [0.0] * len(rows)
+            else:
+                # Every row up to the highest occupied one is scored, so each state stays aligned with its stream
+                self._resize_vad_state(len(batch))
+                with self.metrics.span("vad_batch"), self.torch.inference_mode():
+                    slot_probs = self.vad_model(self.torch.from_numpy(batch), self.sample_rate).flatten().tolist()
+                probs = [slot_probs[stream.slot] for stream, _ in rows]
+                if admitted is not None:
+                    probs = [prob if admit else 0.0 for prob, admit in zip(probs, admitted)]
+            for (stream, frame), prob in zip(rows, probs):
+                if frame is None:
+                    # Padding for a lagging stream, its state saw silence but there is no audio to record
+                    continue
+                finished = stream.update(frame, prob, self.speech_threshold, self.silence_timeout_frames)
+                if finished is not None:
+                    self._submit(finished)
+
+    def _submit(self, utterance):
+        with self.utterance_cond:
+            if len(self.utterances) >= self.max_pending_utterances:
+                self.utterances.popleft()
+                self.dropped += 1
+                self.metrics.inc("utterances_dropped")
+            self.utterances.append(utterance)
+            self.utterance_cond.notify()
+
+    def _asr_loop(self):
+        while True:
+            with self.utterance_cond:
+                self.utterance_cond.wait_for(lambda: self.utterances or not self.is_running)
+                if not self.utterances:
+                    return
+            # Give the other streams a moment to finish their utterances and share the call
+            deadline = time() + self.asr_batch_wait
+            with self.utterance_cond:
+                self.utterance_cond.wait_for(lambda: len(self.utterances) >= self.asr_batch_size or not self.is_running,
+                                             timeout=max(deadline - time(), 0))
+                batch = [self.utterances.popleft() for _ in range(min(self.asr_batch_size, len(self.utterances)))]
+            if not batch:
+                continue
+            with self.metrics.span("asr_batch"):
+                results = self.transcriber([audio for _, _, audio in batch], batch_size=len(batch))
+            self.transcribed += len(batch)
+            for (stream_id, utterance_id, _), result in zip(batch, results):
+                text = result["text"]
+                with self.metrics.span("action_selection"):
+                    action = self.action_selector.generate_action(text)
+                stream = self.streams.get(stream_id)
+                if stream is not None:
+                    try:
+                        stream.on_action(stream_id, action, text)
+                    except Exception as error:
+                        print(f"Stream {stream_id}: action callback failed: {error}")
+
+    def serve_tcp(self, host="127.0.0.1", port=8765):
+        """Accepts network microphones: each connection streams raw 16 kHz mono int16 PCM
+        and receives one "<action>\\t<transcription>" line per utterance. Only local clients
+        by default, pass host="0.0.0.0" to accept other machines on a trusted network."""
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                stream_id = "%s:%d" % self.client_address
+                send_lock = Lock()
+                def on_action(stream_id, action, text):
+                    with send_lock:
+                        self.request.sendall(f"{action}\t{text}\n".encode("utf-8"))
+                try:
+                    server.add_stream(stream_id, on_action)
+                except RuntimeError as error:
+                    print(f"Stream {stream_id} rejected: {error}")
+                    return
+                print(f"Stream {stream_id} connected.")
+                try:
+                    while data := self.request.recv(4096):
+                        server.feed(stream_id, data)
+                finally:
+                    server.remove_stream(stream_id)
+                    print(f"Stream {stream_id} disconnected.")
+
+        self.tcp_server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.tcp_server.daemon_threads = True
+        Thread(target=self.tcp_server.serve_forever, name="voice-server-tcp", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self.utterance_cond:
+            pending = len(self.utterances)
+        return {"streams": len(self.streams), "transcribed": self.transcribed, "dropped": self.dropped, "pending": pending,
+                "vad_steps": self.vad_steps, "vad_steps_skipped": self.vad_steps_skipped}
+
+    def start(self):
+        self.is_running = True
+        self.threads = [Thread(target=self._vad_loop, name="voice-server-vad", daemon=True),
+                        Thread(target=self._asr_loop, name="voice-server-asr", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        for stream in list(self.streams.values()):
+            if stream.source is not None:
+                stream.source.start()
+        print(f"Voice server started with {len(self.streams)} streams...")
+
+    def stop(self):
+        if self.tcp_server is not None:
+            self.tcp_server.shutdown()
+            self.tcp_server.server_close()
+        for stream_id in list(self.streams):
+            self.remove_stream(stream_id)
+        self.is_running = False
+        with self.audio_cond:
+            self.audio_cond.notify_all()
+        with self.utterance_cond:
+            self.utterance_cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        print("Voice server stopped.")
+
+if __name__ == "__main__":
+    # Usage: python VoiceServer.py [max streams] [--energy-gate]
+    # Measures how many real-time streams one core sustains: N synthetic streams are replayed
+    # at real time and the server's CPU time per second of audio gives streams per core.
+    import sys
+    from time import process_time, sleep
+    from AudioSource import SyntheticSource
+
+    max_streams = int(sys.argv[1]) if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else 16
+    energy_gate = "--energy-gate" in sys.argv
+    actions = [
+        Action("turn_on_light", "Turn on the light", "bật đèn", "bật đèn"),
+        Action("turn_off_light", "Turn off the light", "tắt đèn", "tắt đèn"),
+    ]
+    server = VoiceServer(actions, num_threads=1, max_streams=max_streams, energy_gate=energy_gate)
+    seconds = 20.0
+    md_lines = []
+    md_lines.append(f"\n## Voice Server Capacity ({seconds:.0f} s of synthetic audio per stream, 1 thread"
+                    f"{', energy gate' if energy_gate else ''})\n")
+    md_lines.append("| Streams | CPU (% of one core) | Utterances | Dropped | VAD steps skipped | Streams per core |\n")
+    md_lines.append("|---------|---------------------|------------|---------|-------------------|------------------|\n")
+    n_streams = 1
+    while n_streams <= max_streams:
+        for i in range(n_streams):
+            server.add_stream(f"synthetic-{i}", lambda stream_id, action, text: None,
+                              SyntheticSource(seconds=seconds, seed=i))
+        server.transcribed = server.dropped = server.vad_steps = server.vad_steps_skipped = 0
+        cpu_start, wall_start = process_time(), perf_counter()
+        server.start()
+        sleep(seconds + 3.0)
+        cpu = (process_time() - cpu_start) / (perf_counter() - wall_start)
+        stats = server.stats()
+        server.stop()
+        md_lines.append(f"| {n_streams} | {cpu * 100:.1f}% | {stats['transcribed']} | {stats['dropped']} | {stats['vad_steps_skipped'] / max(stats['vad_steps'], 1):.1%} | {n_streams / max(cpu, 1e-9):.1f} |\n")
+        n_streams *= 2
+    print("".join(md_lines))
+
+    with open("Benchmark.md", "a", encoding="utf-8") as file:
+        file.writelines(md_lines)
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+
+from AudioSource import read_wav
+from KeywordMatcher import strip_diacritics, tokenize
+from KeywordSpotter import KeywordSpotter
+
+class WakeWordDetector:
+    """Spots a spoken wake phrase, e.g. "trợ lý ơi", in the speech frames of an utterance.
+
+    The model is a handful of MFCC templates of the phrase compared with DTW, the same
+    front end as KeywordSpotter, so it runs on-device in a few milliseconds. Frames are fed
+    as the VAD passes them; every `check_seconds` the end of the recent audio is compared
+    to each template, so the phrase is detected as soon as it has been said.
+    """
+    def __init__(self, phrase: str, sample_rate=16000, threshold=0.6, check_seconds=0.1, max_seconds=2.0):
+        self.phrase = phrase
+        self.sample_rate = sample_rate
+        self.threshold = threshold   # Maximum normalized DTW distance to accept the phrase
+        self.check_samples = int(check_seconds * sample_rate)
+        self.spotter = KeywordSpotter(sample_rate, max_seconds=max_seconds)
+        self.templates: list[tuple[np.ndarray, int]] = []   # (features, length in samples)
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.max_samples = int(max_seconds * 1.25 * sample_rate)
+        self.unchecked = 0
+        self.detections = 0
+
+    def enroll(self, audio: np.ndarray):
+        """Adds a float32 recording of the phrase as a template."""
+        audio = self.spotter.trim(audio)
+        if 0 < len(audio) <= self.spotter.max_samples:
+            self.templates.append((self.spotter.features(audio), len(audio)))
+
+    def enroll_directory(self, directory: str):
+        """Loads templates from `directory/*.wav` (16 kHz mono 16-bit recordings of the phrase)."""
+        if not os.path.isdir(directory):
+            return
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(".wav"):
+                self.enroll(read_wav(os.path.join(directory, file_name), self.sample_rate).astype(np.float32) / 32768.0)
+
+    def reset(self, pre_roll: np.ndarray | None = None):
+        """Forgets the audio of the previous utterance, starting from the pre-roll of the next one."""
+        self.audio = np.zeros(0, dtype=np.float32) if pre_roll is None else pre_roll[-self.max_samples:].copy()
+        self.unchecked = len(self.audio)
+
+    def feed(self, frame: np.ndarray) -> bool:
+        """Appends one float32 frame and returns True when the phrase was just completed."""
+        self.audio = np.concatenate([self.audio, frame])[-self.max_samples:]
+        self.unchecked += len(frame)
+        if self.unchecked < self.check_samples or not self.templates:
+            return False
+        self.unchecked = 0
+        for template, length in self.templates:
+            # The phrase ends at the newest sample, allow it to be said up to 25% slower
+            window = self.audio[-int(length * 1.25):]
+            if not window.any():
+                continue
+            segment = self.spotter.trim(window)
+            if len(segment) < self.spotter.frame_length:
+                continue
+            if self.spotter.dtw(self.spotter.features(segment), template) < self.threshold:
+                self.detections += 1
+                self.reset()
+                return True
+        return False
+
+    def strip(self, text: str) -> str:
+        """Removes the phrase from the start of a transcript, comparing syllables without diacritics."""
+        phrase = [strip_diacritics(syllable) for syllable in tokenize(self.phrase)]
+        syllables = tokenize(text)
+        if [strip_diacritics(syllable) for syllable in syllables[:len(phrase)]] == phrase:
+            return " ".join(syllables[len(phrase):])
+        return text
+
+if __name__ == "__main__":
+    # Usage: python WakeWord.py <phrase> <templates dir> <clips dir>
+    # <clips dir>/wake/*.wav contain the phrase, <clips dir>/other/*.wav are speech that must not wake.
+    import sys
+    from time import perf_counter
+    phrase, templates_dir, clips_dir = sys.argv[1], sys.argv[2], sys.argv[3]
+    detector = WakeWordDetector(phrase)
+    detector.enroll_directory(templates_dir)
+    counts = {"wake": [0, 0], "other": [0, 0]}   # label -> [detected, clips]
+    frames = 0
+    start_time = perf_counter()
+    for label in counts:
+        directory = os.path.join(clips_dir, label)
+        for file_name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            if not file_name.endswith(".wav"):
+                continue
+            audio = read_wav(os.path.join(directory, file_name)).astype(np.float32) / 32768.0
+            detector.reset()
+            detected = False
+            for i in range(0, len(audio) - 511, 512):
+                frames += 1
+                detected = detector.feed(audio[i:i + 512]) or detected
+            counts[label][0] += detected
+            counts[label][1] += 1
+    per_frame = (perf_counter() - start_time) / max(frames, 1) * 1000
+
+    md_lines = []
+    md_lines.append(f'\n## Wake Word ("{phrase}", {len(detector.templates)} templates)\n')
+    md_lines.append("| Detection rate | False accepts | Time per 32 ms frame (ms) |\n")
+    md_lines.append("|----------------|---------------|---------------------------|\n")
+    md_lines.append(f"| {counts['wake'][0] / max(counts['wake'][1], 1):.2%} ({counts['wake'][0]}/{counts['wake'][1]}) | "
+                    f"{counts['other'][0] / max(counts['other'][1], 1):.2%} ({counts['other'][0]}/{counts['other'][1]}) | {per_frame:.3f} |\n")
+    print("".join(md_lines))
+
+    with open("Benchmark.md", "a", encoding="utf-8") as file:
+        file.writelines(md_lines)
@@ -1,54 +1,81 @@
-import torch
-import torchaudio
 import numpy as np
-import pyaudio
-from queue import Queue
+from queue import Queue, Empty
 from time import sleep, time
-from transformers import pipeline
 from ActionSelector import Action, LLMActionSelector, WordsMatchingActionSelector
 from VietnameseTextToSpeech import VietnameseTextToSpeech
-import speech_recognition as sr
+from ModelLoader import StartupTimer, load_silero_vad, load_phowhisper
+from UtteranceBuffer import UtteranceBuffer
+from UtteranceWorkerPool import UtteranceWorkerPool
+from StreamingTranscriber import StreamingTranscriber
+from threading import Lock
+from KeywordSpotter import KeywordSpotter
+from ActionCache import CachedActionSelector
+from AudioSource import AudioSource, MicrophoneSource
+from Metrics import NULL_METRICS, Metrics
+from Endpointer import AdaptiveEndpointer, FixedEndpointer
+from EnergyGate import EnergyGate
+from WakeWord import WakeWordDetector
 
 class VoiceAssistant:
     def __init__(self, sample_rate=16000, chunk_size=512, 
                  speech_threshold=0.5, silence_timeout=1.0, 
                  pre_buffer_max=32, model=None, api_url=None,
-                 use_google=True):
+                 use_google=True, poll_timeout=0.1, vad_batch_size=4, max_utterance_seconds=30.0,
+                 num_workers=1, max_pending_utterances=4, drop_policy="drop_oldest",
+                 streaming_asr=False, keyword_spotting=False, keyword_templates_dir=None,
+                 vad_backend="torchscript", asr_backend="pytorch", num_threads=None,
+                 action_cache_size=256, action_cache_ttl=3600.0, action_cache_path=None,
+                 llm_reuse_context=False, llm_constrained=False, barge_in=False, barge_in_threshold=0.9,
+                 adaptive_endpointing=False, energy_gate=False, wake_word=None, wake_word_dir=None, wake_word_window=8.0, audio_source: AudioSource | None = None, metrics: Metrics | None = None):
         self.debug = False
+        # Timing spans and counters, NULL_METRICS records nothing
+        self.metrics = metrics or NULL_METRICS
+        # Heavy dependencies are imported lazily so each phase shows up in the startup breakdown
+        timer = StartupTimer()
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
         self.speech_threshold = speech_threshold
         self.silence_timeout = silence_timeout 
         self.pre_buffer_max = pre_buffer_max 
+        self.poll_timeout = poll_timeout
+        # While a reply plays the VAD ignores frames below barge_in_threshold (our own voice),
+        # louder speech interrupts the reply when barge_in is enabled. Off by default: the VAD
+        # alone cannot tell the user from our own voice on speakers, only use it with a headset
+        # or an echo-cancelling microphone
+        self.barge_in = barge_in
+        self.barge_in_threshold = barge_in_threshold
         self.audio_queue = Queue()
         self.is_running = False
         self.recording = False
-        self.audio_buffer = []  
-        self.pre_buffer = []   
+        self.utterance = UtteranceBuffer(sample_rate, chunk_size, pre_roll_frames=pre_buffer_max, max_seconds=max_utterance_seconds)
         self.last_speech_time = 0
+        self.utterance_id = 0
 
-        # Load Silero VAD model
-        self.vad_model, utils = torch.hub.load('snakers4/silero-vad', 'silero_vad')
-        self.get_speech_timestamps = utils[0]
+        with timer.phase("import torch"):
+            from BatchedVAD import BatchedVAD
+
+        # Load Silero VAD model from the local cache
+        with timer.phase("load VAD"):
+            self.vad_model = load_silero_vad(backend=vad_backend, num_threads=num_threads)
+            # Lets clearly silent frames, e.g. hours of an empty room, skip the neural VAD
+            gate = EnergyGate(chunk_size / sample_rate) if energy_gate else None
+            self.vad = BatchedVAD(self.vad_model, self.sample_rate, self.chunk_size, batch_size=vad_batch_size, gate=gate)
 
         # Load PhoWhisper ASR model
         self.transcriber = None
         
         self.use_google = use_google
-        if use_google:
-            self.recognizer = sr.Recognizer()
-        else:
-            self.transcriber = pipeline("automatic-speech-recognition", model="vinai/PhoWhisper-medium")
+        with timer.phase("load ASR"):
+            if use_google:
+                import speech_recognition as sr
+                self.recognizer = sr.Recognizer()
+            else:
+                self.transcriber = load_phowhisper(backend=asr_backend, num_threads=num_threads)
         # Initialize PyAudio
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.sample_rate,
-            input=True,
-            frames_per_buffer=self.chunk_size,
-            stream_callback=self.callback
-        )
+        with timer.phase("open audio source"):
+            # The microphone by default, WAV files or synthetic audio for offline runs and benchmarks
+            self.source = audio_source or MicrophoneSource(self.sample_rate, self.chunk_size)
+            self.source.open(self.callback)
 
         # Initialize action selector
         self.action_lst = [
@@ -64,101 +91,337 @@ class VoiceAssistant:
                 raise ValueError("api_url must be provided when using LLMActionSelector")
             if model is None:
                 model = "llama3.2"
-            self.action_selector = LLMActionSelector(self.action_lst, model=model, api_url=api_url)
-        self.tts = VietnameseTextToSpeech()
+            self.action_selector = LLMActionSelector(self.action_lst, model=model, api_url=api_url,
+                                                     reuse_context=llm_reuse_context, constrained=llm_constrained)
+        # Repeated commands skip the selector, and the LLM round-trip, entirely
+        self.action_selector = CachedActionSelector(self.action_selector, max_size=action_cache_size,
+                                                    ttl=action_cache_ttl, path=action_cache_path)
+        with timer.phase("load TTS"):
+            self.tts = VietnameseTextToSpeech()
+            # Confirmations are a fixed set of phrases, render them once in the background
+            self.tts.prerender([self._confirmation(act) for act in self.action_lst] + [self.failure_reply])
+
+        # ASR, action selection and the spoken reply run off the capture thread
+        self.workers = UtteranceWorkerPool(self._process_utterance, self.execute_action,
+                                           num_workers=num_workers, max_pending=max_pending_utterances,
+                                           drop_policy=drop_policy)
+        self.action_lock = Lock()
+
+        # Decode partial hypotheses while the user is still speaking (PhoWhisper only) and
+        # run the action as soon as a keyword is stable, without waiting for the silence timeout
+        self.streaming = None
+        self.early_actions = {}  # utterance_id -> action already executed from a partial
+        self.early_lock = Lock()
+        if streaming_asr and not self.use_google:
+            self.streaming = StreamingTranscriber(self.transcriber, self.sample_rate, on_partial=self._on_partial_transcription)
+            self.keyword_selector = WordsMatchingActionSelector(self.action_lst)
+
+        # Decides how much trailing silence closes an utterance, the adaptive one shortens it for
+        # clearly finished commands and lengthens it for hesitations
+        frame_seconds = chunk_size / sample_rate
+        if adaptive_endpointing:
+            self.endpointer = AdaptiveEndpointer(frame_seconds, speech_threshold, silence_timeout,
+                                                 keywords=[action.keyword for action in self.action_lst])
+        else:
+            self.endpointer = FixedEndpointer(frame_seconds, speech_threshold, silence_timeout)
+
+        # Only utterances that contain the wake phrase, or follow it within wake_word_window
+        # seconds, are transcribed. TV audio and conversations never reach ASR or the LLM.
+        # The window restarts at each detection and each command that selected an action,
+        # so unrelated speech in it cannot keep the gate open
+        self.wake_word = None
+        self.wake_word_window = wake_word_window
+        self.listening_until = 0.0
+        self.addressed = True        # The current utterance is meant for the assistant
+        self.command_frames = None   # Speech frames after the wake phrase in the current utterance
+        self.command_start = 0       # Sample where the command starts, after a wake phrase spotted mid-utterance
+        self.min_command_frames = int(0.15 * sample_rate / chunk_size)
+        self.uses_llm = model is not None or api_url is not None
+        self.skipped_utterances = 0
+        self.skipped_seconds = 0.0
+        if wake_word is not None:
+            self.wake_word = WakeWordDetector(wake_word, sample_rate)
+            if wake_word_dir is not None:
+                self.wake_word.enroll_directory(wake_word_dir)
+            if not self.wake_word.templates:
+                print(f'No recordings of "{wake_word}" found, wake word gating is disabled.')
+                self.wake_word = None
+
+        # Match short fixed commands against keyword templates before running ASR
+        self.keyword_spotter = None
+        if keyword_spotting:
+            self.keyword_spotter = KeywordSpotter(self.sample_rate)
+            if keyword_templates_dir is not None:
+                self.keyword_spotter.enroll_directory(keyword_templates_dir)
+        timer.report()
 
     def callback(self, in_data, frame_count, time_info, status):
         """Reads audio stream into a queue."""
+        if status:
+            # PyAudio reports an input overflow when chunks were dropped before this callback
+            self.metrics.inc("audio_input_overflows")
         self.audio_queue.put(in_data)
-        return (in_data, pyaudio.paContinue)
+        return (in_data, self.source.continue_flag)
 
     def process_audio(self):
         """Processes audio and performs speech recognition when speech is detected."""
         while self.is_running:
-            if not self.audio_queue.empty():
-                audio_chunk = self.audio_queue.get()
-                # Convert to normalized numpy array
-                audio_np = np.frombuffer(audio_chunk, dtype=np.int16).astype(np.float32) / 32768.0
-                audio_tensor = torch.from_numpy(audio_np)
-
-                # Compute speech probability
-                speech_prob = self.vad_model(audio_tensor, self.sample_rate).item()
-
-                if speech_prob > self.speech_threshold:
-                    self.last_speech_time = time()  
-                    if not self.recording:
-                        print("Speech detected! Recording started...")
-                        self.recording = True
-                        self.audio_buffer = self.pre_buffer.copy()
-                        self.pre_buffer = [] 
-                elif (time() - self.last_speech_time) > self.silence_timeout:
+            try:
+                # Block until the PyAudio callback delivers a chunk instead of spinning on empty()
+                audio_chunk = self.audio_queue.get(timeout=self.poll_timeout)
+            except Empty:
+                # No audio arrived in time, score what is pending and still close an
+                # utterance whose silence timeout elapsed
+                self._process_vad_batch()
+                if self.recording and (time() - self.last_speech_time) > self.endpointer.required_silence():
                     self.recording = False
+                    self._finish_utterance()
+                continue
+            if audio_chunk is None:
+                # Sentinel pushed by stop()
+                break
 
-                if self.recording:
-                    self.audio_buffer.append(audio_np)
-                elif len(self.audio_buffer) >= 1:
-                    print("Silence detected! Transcribing...")
-                    self.transcribe_audio()
-                    self.audio_buffer = []
-                    self.recording = False
+            self.vad.push(audio_chunk)
+            if self.vad.ready():
+                self._process_vad_batch()
 
-                if not self.recording:
-                    self.pre_buffer.append(audio_np)
-                    if len(self.pre_buffer) > self.pre_buffer_max:
-                        self.pre_buffer.pop(0)
+    def _process_vad_batch(self):
+        """Runs VAD over the pending chunks and feeds each frame to the recording state machine."""
+        with self.metrics.span("vad"):
+            frames = self.vad.flush()
+        if self.metrics.enabled:
+            self.metrics.set_gauge("audio_queue_depth", self.audio_queue.qsize())
+            if self.vad.gate is not None:
+                self.metrics.set_gauge("vad_gate_skip_ratio", self.vad.gate.skip_ratio)
+        for audio_np, speech_prob in frames:
+            self._update_recording(audio_np, speech_prob)
 
-    def transcribe_audio(self):
-        """Concatenates buffered audio segments and transcribes using PhoWhisper."""
-        if not self.audio_buffer:
-            return
+    def _update_recording(self, audio_np, speech_prob):
+        """Advances the recording state machine by one frame."""
+        if self.tts.is_speaking:
+            if self.barge_in and speech_prob > self.barge_in_threshold:
+                print("User is speaking, interrupting the reply...")
+                self.tts.cancel()
+            else:
+                speech_prob = 0.0
+        if speech_prob > self.speech_threshold:
+            self.last_speech_time = time()
+            if not self.recording:
+                print("Speech detected! Recording started...")
+                self.recording = True
+                self.utterance.start()
+                self.utterance_id += 1
+                self.endpointer.start()
+                self.addressed = self.wake_word is None or time() < self.listening_until
+                self.command_frames = None
+                self.command_start = 0
+                if self.wake_word is not None:
+                    # The VAD triggers a little late, the phrase may start in the pre-roll
+                    self.wake_word.reset(self.utterance.float32())
+                if self.streaming is not None and self.addressed:
+                    self.streaming.begin_utterance(self.utterance_id)
+            elif self.command_frames is not None:
+                self.command_frames += 1
+        if self.recording and self.endpointer.update(speech_prob):
+            self.recording = False
 
-        full_audio = np.concatenate(self.audio_buffer)
+        if self.recording:
+            self.utterance.append(audio_np)
+            if not self.addressed and self.wake_word.feed(audio_np):
+                self._on_wake_word()
+            if self.streaming is not None:
+                self.streaming.feed(self.utterance_id, self.utterance.float32()[self.command_start:])
+        elif len(self.utterance) >= 1:
+            self._finish_utterance()
+
+        if not self.recording:
+            self.utterance.push_pre_roll(audio_np)
+
+    def _on_wake_word(self):
+        print("Wake word detected, listening...")
+        self.metrics.inc("wake_word_detections")
+        self.addressed = True
+        self.command_frames = 0
+        # The phrase ends at the newest sample, only what follows is the command
+        self.command_start = len(self.utterance)
+        self.listening_until = time() + self.wake_word_window
+        if self.streaming is not None:
+            self.streaming.begin_utterance(self.utterance_id)
+
+    def _skip_utterance(self, reason: str):
+        """Drops an utterance that was not meant for the assistant before any ASR or LLM work."""
+        print(f"{reason}, skipping {self.utterance.duration:.2f} s without transcription.")
+        self.skipped_utterances += 1
+        self.skipped_seconds += self.utterance.duration
+        if self.streaming is not None:
+            self.streaming.end_utterance(self.utterance_id)
+        self.metrics.inc("asr_calls_avoided")
+        self.metrics.inc("asr_seconds_avoided", self.utterance.duration)
+        if self.uses_llm:
+            self.metrics.inc("llm_calls_avoided")
+        self.utterance.clear()
+        self.recording = False
+
+    def _finish_utterance(self):
+        """Hands the buffered utterance to the worker pool and resets the recording state."""
+        if self.wake_word is not None:
+            if not self.addressed:
+                self._skip_utterance("Not addressed to the assistant")
+                return
+            if self.command_frames is not None and self.command_frames < self.min_command_frames:
+                # Only the wake phrase was said, the command follows in the listening window
+                self._skip_utterance("Wake word only")
+                return
+        # Time from the last speech frame until the utterance was closed (VAD hangover)
+        self.metrics.observe("endpoint_delay", time() - self.last_speech_time)
+        self.metrics.inc(f"endpoints_{self.endpointer.reason}")
+        print(f"Silence detected! Queueing {self.utterance.duration:.2f} s for transcription "
+              f"({self.utterance.nbytes / 1024:.0f} KB buffered{', truncated' if self.utterance.truncated else ''})...")
+        if self.streaming is not None:
+            with self.early_lock:
+                self.streaming.end_utterance(self.utterance_id)
+        if not self.workers.submit((self.utterance_id, *self.utterance.snapshot(self.command_start))):
+            print("Transcription queue is full, utterance dropped.")
+            self.metrics.inc("utterances_dropped")
+        if self.metrics.enabled:
+            self.metrics.set_gauge("utterance_queue_depth", self.workers.queue_depth())
+        self.utterance.clear()
+        self.recording = False
+
+    def _process_utterance(self, audio):
+        with self.metrics.span("transcribe_audio"):
+            return self.transcribe_audio(audio)
+
+    def transcribe_audio(self, audio):
+        """Transcribes one utterance using Google ASR or PhoWhisper and selects its action. Runs on a worker thread."""
+        utterance_id, full_audio, pcm16 = audio
         
         # Save to a file if debugging is enabled
         if self.debug:
+            import torch
+            import torchaudio
             audio_tensor = torch.from_numpy(full_audio)
             torchaudio.save("temp.wav", audio_tensor.unsqueeze(0), self.sample_rate)
 
-        
+        if self.keyword_spotter is not None:
+            with self.metrics.span("keyword_spotting"):
+                action_name = self.keyword_spotter.spot(full_audio)
+            if action_name is not None:
+                print("Keyword spotted:", action_name)
+                return None if self._take_early_action(utterance_id) is not None else action_name
+
         if self.use_google:
-            audio_bytes = (full_audio * 32767).astype(np.int16).tobytes()
-            audio_data = sr.AudioData(audio_bytes, sample_rate=16000, sample_width=2)
+            import speech_recognition as sr
+            audio_bytes = pcm16.tobytes()
+            audio_data = sr.AudioData(audio_bytes, sample_rate=self.sample_rate, sample_width=2)
             try:
-                transcription = self.recognizer.recognize_google(audio_data, language="vi-VN")
+                with self.metrics.span("asr"):
+                    transcription = self.recognizer.recognize_google(audio_data, language="vi-VN")
             except:
                 print("Could not understand audio")
                 transcription = "unknown"
             print("Transcription:", transcription)
             transcription_text = transcription
         else:
-            result = self.transcriber(full_audio)
+            with self.metrics.span("asr"):
+                result = self.transcriber(full_audio)
             print("Transcription:", result["text"])
             transcription_text = result["text"]
 
-        # Generate action
-        action = self.action_selector.generate_action(transcription_text)
-        print("Action:", action)
-        flag = False
-        for act in self.action_lst:
-            if act.name in action:
-                self.tts.speak("Đã thực hiện hành động " + act.vietnamese_description)
-                flag = True
-                break
-        if not flag:
-            self.tts.speak("Không thể thực hiện hành động")
+        if self.wake_word is not None:
+            transcription_text = self.wake_word.strip(transcription_text)
+        early_action = self._take_early_action(utterance_id)
+
+        # Generate every action of the command, e.g. "tắt đèn và bật quạt", in one selector call
+        with self.metrics.span("action_selection"):
+            actions = self.action_selector.generate_actions(transcription_text)
+        if self.keyword_spotter is not None and isinstance(actions, list) and len(actions) == 1:
+            # Learn a keyword template from utterances ASR understood, only when they say the keyword itself
+            keyword = next((act.keyword for act in self.action_lst if act.name == actions[0]), None)
+            if keyword and keyword in transcription_text.lower():
+                self.keyword_spotter.learn(actions[0], full_audio)
+        if early_action is not None:
+            # Only the actions after the early one are still to run
+            # "bật đèn rồi tắt đèn rồi bật đèn" still has to turn the light on again at the end
+            remaining = list(actions) if isinstance(actions, list) else []
+            if early_action in remaining:
+                remaining.remove(early_action)
+            return remaining or None
+        return actions
+
+    def _take_early_action(self, utterance_id):
+        """The action of this utterance that already ran from a stable partial hypothesis, if any."""
+        with self.early_lock:
+            return self.early_actions.pop(utterance_id, None)
+
+    def _on_partial_transcription(self, utterance_id, text, stable_text):
+        """Executes the action as soon as a stable partial hypothesis contains its keyword."""
+        print("Partial transcription:", text)
+        if utterance_id == self.utterance_id:
+            self.endpointer.on_partial(text)
+        action = self.keyword_selector.generate_action(stable_text)
+        if action == "unknown":
+            return
+        with self.early_lock:
+            if not self.streaming.is_active(utterance_id) or utterance_id in self.early_actions:
+                return
+            if not self.workers.is_idle():
+                # An earlier utterance has not run its actions yet, this one must not overtake it
+                return
+            self.early_actions[utterance_id] = action
+            # Dispatched before the utterance can be submitted, so its remaining actions follow this one
+            print("Keyword is stable, executing before end of speech...")
+            self.execute_action(action)
+
+    failure_reply = "Không thể thực hiện hành động"
+
+    @staticmethod
+    def _confirmation(act):
+        return "Đã thực hiện hành động " + act.vietnamese_description
+
+    def execute_action(self, action):
+        """Responds to the selected action, or list of actions in spoken order. Called in utterance order,
+        the replies are queued and played asynchronously."""
+        if action is None:
+            return
+        with self.action_lock, self.metrics.span("action"):
+            print("Action:", action)
+            flag = False
+            for name in [action] if isinstance(action, str) else action:
+                for act in self.action_lst:
+                    if act.name in name:
+                        self.tts.speak(self._confirmation(act), cache=True)
+                        flag = True
+                        break
+            if not flag:
+                self.tts.speak(self.failure_reply, cache=True)
+            elif self.wake_word is not None:
+                self.listening_until = time() + self.wake_word_window
 
     def start(self):
-        """Starts the microphone stream."""
+        """Starts the audio source."""
         self.is_running = True
-        self.stream.start_stream()
+        self.workers.start()
+        if self.streaming is not None:
+            self.streaming.start()
+        self.source.start()
         print("Speech Recognition started...")
 
     def stop(self):
-        """Stops the microphone stream."""
+        """Stops the audio source."""
         self.is_running = False
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        # Wake up process_audio if it is blocked on an empty queue
+        self.audio_queue.put(None)
+        self.source.stop()
+        self.source.close()
+        self.workers.stop()
+        if self.streaming is not None:
+            self.streaming.stop()
+        self.action_selector.close()
+        self.tts.stop()
+        if self.wake_word is not None:
+            print(f"Wake word: {self.wake_word.detections} detections, {self.skipped_utterances} utterances "
+                  f"({self.skipped_seconds:.1f} s) skipped without ASR{' or LLM' if self.uses_llm else ''}.")
         print("Speech Recognition stopped.")
 
 if __name__ == "__main__":